@@ -0,0 +1,152 @@
+"""
+Admission control for the HTTP server.
+Per-client token-bucket rate limits, a global in-flight request cap and
+request body size limits, with counters so shed traffic is visible.
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def take(self, now):
+        """Take one token. Returns 0 on success, otherwise seconds until one is available"""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimit:
+    """Limit of `per_minute` requests per client with a `burst` allowance"""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.burst = burst if burst is not None else max(1, per_minute)
+
+
+class AdmissionController:
+    """
+    Decides whether a request may be processed.
+
+    - `limits` maps route paths to a RateLimit, keyed per client IP.
+      `default_limit` is one budget per client shared by all API routes not
+      listed (None = unlimited), so paths with ids in them, or made-up
+      paths, don't each get a fresh bucket.
+    - `max_in_flight` caps concurrent API requests across all clients so load
+      is shed before the database connection pool runs dry.
+    - `max_body` maps route paths to a maximum Content-Length in bytes,
+      `default_max_body` applies to everything else.
+    """
+
+    # Bucket/stats key for routes without their own limit
+    DEFAULT_ROUTE = '*'
+
+    # Buckets untouched for this long are dropped when pruning
+    IDLE_BUCKET_SECONDS = 600
+    PRUNE_EVERY = 1000
+
+    def __init__(self, limits=None, default_limit=None, max_in_flight=15,
+                 max_body=None, default_max_body=64 * 1024, retry_after=1):
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.max_in_flight = max_in_flight
+        self.max_body = max_body or {}
+        self.default_max_body = default_max_body
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._calls = 0
+        self._in_flight = 0
+        self.stats = {
+            'admitted': 0,
+            'rate_limited': 0,
+            'overloaded': 0,
+            'body_too_large': 0,
+            'peak_in_flight': 0,
+            'rate_limited_by_route': {},
+        }
+
+    def check_rate(self, client_ip, path):
+        """Return 0 if the client may proceed, otherwise seconds to wait"""
+        route = path if path in self.limits else self.DEFAULT_ROUTE
+        limit = self.limits.get(route, self.default_limit)
+        if limit is None:
+            return 0
+
+        now = time.monotonic()
+        key = (client_ip, route)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(limit.rate, limit.burst)
+            wait = bucket.take(now)
+            if wait:
+                self.stats['rate_limited'] += 1
+                by_route = self.stats['rate_limited_by_route']
+                by_route[route] = by_route.get(route, 0) + 1
+
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        cutoff = now - self.IDLE_BUCKET_SECONDS
+        stale = [k for k, b in self._buckets.items() if b.updated < cutoff]
+        for k in stale:
+            del self._buckets[k]
+
+    def check_body(self, path, content_length):
+        """Return True if a body of `content_length` bytes is acceptable for `path`"""
+        limit = self.max_body.get(path, self.default_max_body)
+        if content_length > limit:
+            with self._lock:
+                self.stats['body_too_large'] += 1
+            return False
+        return True
+
+    def enter(self):
+        """Reserve an in-flight slot. Returns False if the server is saturated"""
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self.stats['overloaded'] += 1
+                return False
+            self._in_flight += 1
+            self.stats['admitted'] += 1
+            if self._in_flight > self.stats['peak_in_flight']:
+                self.stats['peak_in_flight'] = self._in_flight
+            return True
+
+    def leave(self):
+        """Release a slot reserved by enter()"""
+        with self._lock:
+            self._in_flight -= 1
+
+    def snapshot(self):
+        """Copy of the counters for reporting"""
+        with self._lock:
+            data = dict(self.stats)
+            data['rate_limited_by_route'] = dict(self.stats['rate_limited_by_route'])
+            data['in_flight'] = self._in_flight
+            data['max_in_flight'] = self.max_in_flight
+            data['tracked_clients'] = len(self._buckets)
+        return data
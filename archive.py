@@ -0,0 +1,140 @@
+"""
+Hot/cold order archival.
+Closed orders (completed/cancelled) older than a configurable age are moved
+from the `orders` table into `order_archive`, where they are stored compressed
+with only their lookup columns indexed. Run directly for a one-off pass:
+
+    python archive.py --days 90
+"""
+
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+
+from models import get_session, Order, ArchivedOrder
+
+ARCHIVABLE_STATUSES = ('completed', 'cancelled')
+
+
+def archive_orders(older_than_days, batch_size=500):
+    """Move closed orders older than `older_than_days` into the archive.
+    Each batch is copied and deleted in one transaction. Returns the number
+    of orders archived."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = 0
+
+    while True:
+        session = get_session()
+        try:
+            # The newest order always stays hot so SQLite never hands out an
+            # archived id again (it reuses max(rowid) + 1)
+            newest_id = session.query(func.max(Order.id)).scalar()
+            orders = session.query(Order).filter(
+                Order.status.in_(ARCHIVABLE_STATUSES),
+                func.coalesce(Order.updated_at, Order.timestamp) < cutoff,
+                Order.id != newest_id
+            ).order_by(Order.id).limit(batch_size).all()
+
+            if not orders:
+                session.rollback()
+                break
+
+            for order in orders:
+                session.merge(ArchivedOrder.from_order(order))
+                session.delete(order)
+            session.commit()
+            archived += len(orders)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if len(orders) < batch_size:
+            break
+
+    return archived
+
+
+def find_order(session, order_id):
+    """Look up a single order by id, hot table first. Returns a dict or None"""
+    order = session.query(Order).filter_by(id=order_id).first()
+    if order:
+        return order.to_dict()
+    archived = session.query(ArchivedOrder).filter_by(id=order_id).first()
+    return archived.to_dict() if archived else None
+
+
+def _apply_filters(query, model, q, status, start, end):
+    if q:
+        if q.isdigit():
+            # An order number or (part of) a phone number, however it was formatted
+            phone = model.customer_phone
+            for separator in ('-', ' ', '(', ')', '.', '+'):
+                phone = func.replace(phone, separator, '')
+            conditions = [phone.like(f'%{q}%')]
+            if int(q) < 2 ** 31:
+                conditions.append(model.id == int(q))
+            query = query.filter(or_(*conditions))
+        else:
+            pattern = f'%{q}%'
+            query = query.filter(or_(
+                model.customer_name.ilike(pattern),
+                model.customer_email.ilike(pattern),
+                model.customer_phone.ilike(pattern)
+            ))
+    if status:
+        query = query.filter(model.status == status)
+    if start:
+        query = query.filter(model.timestamp >= start)
+    if end:
+        query = query.filter(model.timestamp < end)
+    return query
+
+
+def search_orders(session, q=None, status=None, start=None, end=None,
+                  limit=200, include_archive=True):
+    """Search hot and (optionally) archived orders, newest first.
+    At most `limit` orders are read from each table, so only the returned
+    archive rows are decompressed."""
+    hot = _apply_filters(session.query(Order), Order, q, status, start, end)
+    results = [(o.timestamp, o.to_dict()) for o in
+               hot.order_by(Order.timestamp.desc()).limit(limit)]
+
+    if include_archive and status not in ('pending', 'confirmed', 'ready'):
+        cold = _apply_filters(session.query(ArchivedOrder), ArchivedOrder, q, status, start, end)
+        results += [(a.timestamp, a.to_dict()) for a in
+                    cold.order_by(ArchivedOrder.timestamp.desc()).limit(limit)]
+
+    results.sort(key=lambda r: r[0], reverse=True)
+    return [data for _, data in results[:limit]]
+
+
+def start_archiver(interval, older_than_days):
+    """Run archive_orders() every `interval` seconds on a daemon thread"""
+    def loop():
+        while True:
+            try:
+                count = archive_orders(older_than_days)
+                if count:
+                    print(f"✓ Archived {count} orders older than {older_than_days} days", flush=True)
+            except Exception as e:
+                print(f"✗ Order archival failed: {e}", flush=True)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='order-archiver', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move old completed/cancelled orders to the archive')
+    parser.add_argument('--days', type=int, default=90, help='Archive orders closed more than this many days ago')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    count = archive_orders(args.days, args.batch_size)
+    print(f"✓ Archived {count} orders older than {args.days} days")
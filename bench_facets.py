@@ -0,0 +1,126 @@
+"""
+Benchmark: inventory facets from the columnar engine vs. the ORM.
+Builds a throwaway SQLite database with N tires, then times per-size and
+per-brand listings/quantity/value computed three ways:
+
+  orm     - load every Tire object and aggregate in Python (what the catalog did)
+  groupby - SUM ... GROUP BY in SQL
+  engine  - InventoryEngine.facets() (after its one-off build)
+
+    python bench_facets.py --rows 1000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    # models reads DATABASE_URL when imported
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from sqlalchemy import func, insert
+    from models import get_session, engine, Tire
+    from inventory_engine import InventoryEngine, np
+
+    widths = [185, 195, 205, 215, 225, 235, 245, 255, 265, 275]
+    ratios = [40, 45, 50, 55, 60, 65, 70]
+    rims = [14, 15, 16, 17, 18, 19, 20]
+    brands = [f'Brand {i}' for i in range(60)]
+    rng = random.Random(42)
+
+    print(f"Creating {args.rows:,} tires in {db_path} ...")
+    with engine.begin() as conn:
+        batch = []
+        for i in range(1, args.rows + 1):
+            batch.append({
+                'id': i,
+                'size': f'{rng.choice(widths)}/{rng.choice(ratios)}R{rng.choice(rims)}',
+                'brand': rng.choice(brands),
+                'quantity': rng.randint(0, 8),
+                'price': round(rng.uniform(20, 200), 2),
+            })
+            if len(batch) == 50000:
+                conn.execute(insert(Tire), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(Tire), batch)
+
+    def orm_facets():
+        session = get_session()
+        try:
+            sizes, brand_totals = {}, {}
+            for tire in session.query(Tire).all():
+                for groups, key in ((sizes, tire.size), (brand_totals, tire.brand)):
+                    g = groups.setdefault(key, [0, 0, 0.0])
+                    g[0] += 1
+                    g[1] += tire.quantity
+                    g[2] += tire.quantity * tire.price
+            return sizes, brand_totals
+        finally:
+            session.close()
+
+    def groupby_facets():
+        session = get_session()
+        try:
+            aggregates = (func.count(Tire.id), func.sum(Tire.quantity), func.sum(Tire.quantity * Tire.price))
+            sizes = session.query(Tire.size, *aggregates).group_by(Tire.size).all()
+            brand_totals = session.query(Tire.brand, *aggregates).group_by(Tire.brand).all()
+            return sizes, brand_totals
+        finally:
+            session.close()
+
+    # No overlap window: the rows were all just inserted, and re-reading them
+    # would hide the cost of a normal incremental sync
+    inventory = InventoryEngine(get_session, full_rebuild_interval=10 ** 9, sync_overlap=0)
+    build_time, _ = timed(inventory.rebuild, 1)
+
+    results = [
+        ('orm (load all + Python loop)', *timed(orm_facets, max(1, args.repeat // 2))),
+        ('SQL GROUP BY', *timed(groupby_facets, args.repeat)),
+        ('engine facets (all rows)', *timed(lambda: inventory.facets(include_value=True), args.repeat)),
+        ('engine facets (size_like=R17, in stock)',
+         *timed(lambda: inventory.facets(size_like='R17', in_stock=True, include_value=True), args.repeat)),
+    ]
+
+    # Incremental sync after a small edit
+    session = get_session()
+    for tire in session.query(Tire).filter(Tire.id <= 100):
+        tire.quantity += 1
+    session.commit()
+    session.close()
+    inventory.mark_dirty(tire_ids=range(1, 101))
+    sync_time, _ = timed(inventory.sync, 1)
+
+    # Same answer as the ORM
+    orm_sizes, _ = orm_facets()
+    engine_sizes = {g['size']: g for g in inventory.facets(include_value=True)['sizes']}
+    assert all(engine_sizes[k]['quantity'] == v[1] for k, v in orm_sizes.items())
+
+    print(f"\nRows: {args.rows:,}   NumPy: {'yes' if np is not None else 'no (Python fallback)'}")
+    print(f"{'engine full build':<42}{build_time * 1000:>12.1f} ms")
+    print(f"{'engine incremental sync (100 rows)':<42}{sync_time * 1000:>12.1f} ms")
+    for name, seconds, _ in results:
+        print(f"{name:<42}{seconds * 1000:>12.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
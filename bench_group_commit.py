@@ -0,0 +1,163 @@
+"""
+Benchmark: group-committed order writes vs. one transaction per order.
+Builds a throwaway SQLite database (or, with --use-env, uses DATABASE_URL,
+which must point at an empty database made for the benchmark) and submits
+orders from N concurrent threads two ways:
+
+  per-request - orders.place_order(), one session and commit per order
+  batched     - OrderBatcher.submit(), one commit per window of orders
+
+A share of the orders compete for a few scarce tires (every thread opens
+with one at the same moment), so both paths also exercise per-order
+rejections. Each run then checks that no tire sold more than its starting
+stock and that its remaining stock accounts for every unit sold.
+
+    python bench_group_commit.py --orders 2000 --threads 32
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--tires', type=int, default=200)
+    parser.add_argument('--window-ms', type=float, default=5)
+    parser.add_argument('--max-batch', type=int, default=50)
+    parser.add_argument('--use-env', action='store_true',
+                        help='use the DATABASE_URL already set (e.g. a PostgreSQL database created for the '
+                             'benchmark) instead of a temp SQLite file; it must be empty, and is emptied again')
+    args = parser.parse_args()
+
+    if not args.use_env:
+        db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        # models reads DATABASE_URL when imported
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from sqlalchemy import insert
+    from models import get_session, engine, Tire, Order, ArchivedOrder, Location, LocationStock, IdempotencyKey
+    import idempotency
+    import orders
+    from order_batcher import OrderBatcher
+
+    rng = random.Random(7)
+    prices = {i: round(rng.uniform(40, 200), 2) for i in range(1, args.tires + 1)}
+
+    # Enough stock for most orders; a few tires run out part-way
+    starting = {i: 5 if i % 20 == 0 else 10 ** 6 for i in prices}
+
+    # The runs delete every order and tire, so never point them at a shop's data
+    session = get_session()
+    in_use = [model.__tablename__ for model in (Tire, Order, ArchivedOrder, Location, LocationStock, IdempotencyKey)
+              if session.query(model).first() is not None]
+    session.close()
+    if in_use:
+        parser.error(f"{engine.url.render_as_string(hide_password=True)} already has data in "
+                     f"{', '.join(in_use)}; run against an empty database created for the benchmark")
+
+    def clear():
+        session = get_session()
+        session.query(Order).delete()
+        session.query(IdempotencyKey).delete()
+        session.query(Tire).delete()
+        session.commit()
+        session.close()
+
+    def reset():
+        clear()
+        with engine.begin() as conn:
+            conn.execute(insert(Tire), [
+                {'id': i, 'size': '205/55R16', 'brand': 'Bench', 'price': price, 'quantity': starting[i]}
+                for i, price in prices.items()
+            ])
+
+    scarce = [i for i, qty in starting.items() if qty < 100]
+
+    def make_order():
+        # A share of orders compete for the scarce tires, so lost updates
+        # (overselling) would show up in the checks below
+        tire_id = rng.choice(scarce) if rng.random() < 0.2 else rng.randint(1, args.tires)
+        qty = rng.randint(1, 4)
+        return {
+            'customer': {'firstName': 'Bench', 'lastName': 'User', 'email': 'bench@example.com'},
+            'orderType': 'pickup',
+            'items': [{'id': tire_id, 'selected_qty': qty, 'price': prices[tire_id]}],
+            'total': round(qty * prices[tire_id], 2),
+        }
+
+    def run(write):
+        reset()
+        work = [make_order() for _ in range(args.orders)]
+        # Every thread opens with an order for the same scarce tire
+        for order_data in work[:args.threads]:
+            order_data['items'][0].update(id=scarce[0], selected_qty=1, price=prices[scarce[0]])
+            order_data['total'] = prices[scarce[0]]
+        counts = {'created': 0, 'rejected': 0, 'replayed': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        start_together = threading.Barrier(args.threads)
+
+        def worker(chunk):
+            start_together.wait()
+            for n, order_data in enumerate(chunk):
+                # Half the orders carry an Idempotency-Key, as not every client sends one
+                key = str(uuid.uuid4()) if n % 2 else None
+                try:
+                    kind = write(order_data, key, idempotency.fingerprint(order_data)).kind
+                except Exception:
+                    kind = 'errors'
+                with lock:
+                    counts[kind] += 1
+
+        threads = [threading.Thread(target=worker, args=(work[i::args.threads],)) for i in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        # Whichever path wrote them, the created orders must not have sold more
+        # of a tire than it started with, and stock must account for every sale
+        session = get_session()
+        sold = {}
+        for order in session.query(Order):
+            for item in order.items:
+                sold[item['id']] = sold.get(item['id'], 0) + item['selected_qty']
+        remaining = dict(session.query(Tire.id, Tire.quantity))
+        session.close()
+        for tire_id, qty in sold.items():
+            assert qty <= starting[tire_id], f'tire {tire_id} oversold: {qty} of {starting[tire_id]}'
+            assert remaining[tire_id] == starting[tire_id] - qty, f'tire {tire_id} stock lost an update'
+        return elapsed, counts
+
+    def per_request(order_data, key, request_hash):
+        return orders.place_order(order_data, key, request_hash)
+
+    batcher = OrderBatcher(window_ms=args.window_ms, max_batch=args.max_batch)
+
+    try:
+        results = [
+            ('per-request transactions', *run(per_request)),
+            (f'batched ({args.window_ms:g} ms window)', *run(batcher.submit)),
+        ]
+    finally:
+        clear()
+
+    print(f"\nDatabase: {engine.url.get_backend_name()}   orders: {args.orders:,}   threads: {args.threads}")
+    for name, seconds, counts in results:
+        print(f"{name:<32}{args.orders / seconds:>10.0f} orders/s   "
+              f"created {counts['created']}, rejected {counts['rejected']}, errors {counts['errors']}")
+    stats = batcher.stats
+    print(f"batches: {stats['batches']}   largest: {stats['largest_batch']}   "
+          f"avg: {stats['orders'] / max(1, stats['batches']):.1f}   fallbacks: {stats['fallbacks']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Set-based bulk edits for the admin: change the price or stock of every tire
+matching a filter with one UPDATE ... WHERE, instead of editing rows one by
+one and posting the whole catalog back.
+
+    {"filter": {"sizeLike": "R17"}, "operation": {"field": "price", "op": "add", "value": 5}}
+
+A preview counts (and samples) the rows an operation would change without
+writing anything.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import Float, Integer, Numeric, and_, case, cast, func, literal, select, update
+
+import locations
+from models import Tire, LocationStock
+
+PRICE_OPS = ('set', 'add', 'multiply', 'round')
+QUANTITY_OPS = ('set', 'adjust')
+SAMPLE_SIZE = 10
+
+
+def _number(data, key, kind=float):
+    value = data.get(key)
+    if value is None or value == '':
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{key} must be a number')
+
+
+def parse_filter(data):
+    """SQL condition for a filter like
+    {size, sizeLike, brand, minQty, maxQty, minPrice, maxPrice}.
+    `sizeLike` is a case-insensitive substring ("R17") and `brand` a
+    case-insensitive exact match, as in the catalog facets. An empty filter
+    must say {"all": true}."""
+    data = data or {}
+    conditions = []
+    if data.get('size'):
+        conditions.append(Tire.size == str(data['size']).strip())
+    if data.get('sizeLike'):
+        pattern = str(data['sizeLike']).strip().upper()
+        pattern = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append(func.upper(Tire.size).like(f'%{pattern}%', escape='\\'))
+    if data.get('brand'):
+        conditions.append(func.lower(func.trim(Tire.brand)) == str(data['brand']).strip().lower())
+    min_qty, max_qty = _number(data, 'minQty', int), _number(data, 'maxQty', int)
+    if min_qty is not None:
+        conditions.append(Tire.quantity >= min_qty)
+    if max_qty is not None:
+        conditions.append(Tire.quantity <= max_qty)
+    min_price, max_price = _number(data, 'minPrice'), _number(data, 'maxPrice')
+    if min_price is not None:
+        conditions.append(Tire.price >= min_price)
+    if max_price is not None:
+        conditions.append(Tire.price <= max_price)
+
+    if not conditions:
+        if data.get('all') is not True:
+            raise ValueError('Filter matches every tire; send {"all": true} to confirm')
+        return Tire.id.isnot(None)
+    return and_(*conditions)
+
+
+def _cents(expr):
+    # round(double, int) doesn't exist on PostgreSQL; go through NUMERIC
+    return cast(func.round(cast(expr, Numeric), 2), Float)
+
+
+def _not_negative(expr):
+    return case((expr < 0, 0), else_=expr)
+
+
+class Operation:
+    """A parsed {field, op, value}. `expression` is the new column value in
+    SQL; `apply` computes the same value in Python (for location-tracked
+    tires, whose stock has to go through locations.py)."""
+
+    def __init__(self, data):
+        data = data or {}
+        self.field = data.get('field')
+        self.op = data.get('op')
+        if self.field == 'price':
+            if self.op not in PRICE_OPS:
+                raise ValueError(f'Price operation must be one of: {", ".join(PRICE_OPS)}')
+            default = 1 if self.op == 'round' else None
+            self.value = _number(data, 'value') if data.get('value') is not None else default
+            if self.value is None:
+                raise ValueError('value is required')
+            if self.op in ('set', 'multiply') and self.value < 0:
+                raise ValueError('value must not be negative')
+            if self.op == 'round' and self.value <= 0:
+                raise ValueError('Round to a positive step, e.g. 1 for whole dollars')
+            self.column = Tire.price
+        elif self.field == 'quantity':
+            if self.op not in QUANTITY_OPS:
+                raise ValueError(f'Quantity operation must be one of: {", ".join(QUANTITY_OPS)}')
+            self.value = _number(data, 'value', int)
+            if self.value is None:
+                raise ValueError('value is required')
+            if self.op == 'set' and self.value < 0:
+                raise ValueError('value must not be negative')
+            self.column = Tire.quantity
+        else:
+            raise ValueError('field must be "price" or "quantity"')
+
+    @property
+    def expression(self):
+        column, value = self.column, self.value
+        if self.field == 'price':
+            if self.op == 'set':
+                return _cents(value)
+            if self.op == 'add':
+                return _not_negative(_cents(column + value))
+            if self.op == 'multiply':
+                return _cents(column * value)
+            # Nearest multiple of the step (1 = whole dollars, 0.5, 5, ...)
+            return _cents(func.round(column / value) * value)
+        if self.op == 'set':
+            return literal(value, Integer)
+        return _not_negative(column + value)
+
+    def apply(self, current):
+        """New quantity for one tire (quantity operations only)"""
+        if self.op == 'set':
+            return self.value
+        return max(0, current + self.value)
+
+    def describe(self):
+        return {'field': self.field, 'op': self.op, 'value': self.value}
+
+
+def _tracked():
+    return Tire.id.in_(select(LocationStock.tire_id).distinct())
+
+
+def preview(session, condition, operation):
+    """Counts for `operation` on tires matching `condition`, without writing:
+    matched rows, rows whose value would change, and how many of those are
+    stocked per location; plus a sample of the changes"""
+    new_value = operation.expression
+    changes = operation.column != new_value
+    tracked = _tracked() if operation.field == 'quantity' else None
+
+    columns = [func.count(Tire.id), func.sum(case((changes, 1), else_=0))]
+    if tracked is not None:
+        columns.append(func.sum(case((and_(changes, tracked), 1), else_=0)))
+    counts = session.execute(select(*columns).where(condition)).one()
+
+    sample = session.execute(
+        select(Tire.id, Tire.size, Tire.brand, operation.column, new_value)
+        .where(condition, changes).order_by(Tire.id).limit(SAMPLE_SIZE)
+    )
+    return {
+        'operation': operation.describe(),
+        'matched': counts[0] or 0,
+        'changed': counts[1] or 0,
+        'tracked': (counts[2] or 0) if tracked is not None else 0,
+        'sample': [
+            {'id': tire_id, 'size': size, 'brand': brand, 'old': old, 'new': new}
+            for tire_id, size, brand, old, new in sample
+        ],
+    }
+
+
+def apply(session, condition, operation):
+    """Apply `operation` to tires matching `condition` in the caller's
+    transaction. Returns the number of tires changed.
+
+    Everything goes through one UPDATE except quantity changes to tires that
+    are stocked per location: Tire.quantity is their locations' total, so
+    those go through locations.set_total row by row."""
+    new_value = operation.expression
+    changes = operation.column != new_value
+    count = 0
+
+    if operation.field == 'quantity':
+        tracked = (
+            session.query(Tire).filter(condition, changes, _tracked())
+            .order_by(Tire.id).with_for_update().all()
+        )
+        for tire in tracked:
+            locations.set_total(session, tire, operation.apply(tire.quantity), tracked=True)
+            count += 1
+        session.flush()
+        condition = and_(condition, ~_tracked())
+
+    result = session.execute(
+        update(Tire)
+        .where(condition, changes)
+        .values({operation.column: new_value, Tire.updated_at: datetime.utcnow()})
+        .execution_options(synchronize_session=False)
+    )
+    return count + result.rowcount
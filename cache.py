@@ -0,0 +1,75 @@
+"""
+In-process caches keyed by inventory version.
+Anything that changes tires calls invalidate_inventory() after committing;
+that bumps the version (so older cache entries stop matching) and notifies
+registered listeners.
+"""
+
+import threading
+import time
+
+_lock = threading.Lock()
+_version = 0
+_listeners = []
+
+
+def inventory_version():
+    return _version
+
+
+def invalidate_inventory(tire_ids=None):
+    """Mark cached inventory-derived data as stale. Returns the new version.
+    `tire_ids` lists the tires that changed when the caller knows them;
+    None means any tire may have changed (e.g. an import or bulk edit)."""
+    global _version
+    with _lock:
+        _version += 1
+        version = _version
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(version, tire_ids)
+        except Exception as e:
+            print(f"✗ Inventory listener failed: {e}", flush=True)
+    return version
+
+
+def on_inventory_change(listener):
+    """Call `listener(version, tire_ids)` after every invalidate_inventory()"""
+    with _lock:
+        _listeners.append(listener)
+    return listener
+
+
+class VersionedCache:
+    """Small TTL cache whose entries are only valid for the inventory version
+    they were computed at"""
+
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (version, expires, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        version = _version
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, version):
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                now = time.monotonic()
+                current = _version
+                for k in [k for k, e in self._entries.items() if e[1] <= now or e[0] != current]:
+                    del self._entries[k]
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
@@ -0,0 +1,157 @@
+"""
+Idempotency-Key support for POST endpoints.
+The first request with a key stores its response in the database (in the same
+transaction as its writes); repeats of that key get the stored response back.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from models import get_session, IdempotencyKey
+
+MAX_KEY_LENGTH = 255
+
+# Request fields the client generates per attempt; they don't change the request's meaning
+VOLATILE_FIELDS = ('id', 'timestamp', 'status')
+
+
+def fingerprint(data):
+    """Stable hash of a decoded JSON request body"""
+    if isinstance(data, dict):
+        data = {k: v for k, v in data.items() if k not in VOLATILE_FIELDS}
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ReplayCache:
+    """
+    Per-process cache of stored responses plus per-key locks.
+
+    Concurrent duplicates arriving at this process wait on the key's lock and
+    are then answered from the cache without another database round trip.
+    Duplicates arriving at another process are caught by the primary key on
+    `idempotency_keys`.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (request_hash, status, body, expires)
+        self._key_locks = {}  # key -> [lock, waiters]
+
+    @contextmanager
+    def key_lock(self, key):
+        with self._lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[:3]
+
+    def put(self, key, request_hash, status, body, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict_expired()
+                if len(self._entries) >= self.max_entries:
+                    # Still full: drop the oldest insertion
+                    self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (request_hash, status, body, expires)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for k in [k for k, e in self._entries.items() if e[3] < now]:
+            del self._entries[k]
+
+
+def lookup(session, key):
+    """Return the stored IdempotencyKey row, or None. Expired rows are deleted"""
+    record = session.query(IdempotencyKey).filter_by(key=key).first()
+    if record and record.expires_at < datetime.utcnow():
+        session.delete(record)
+        session.flush()
+        return None
+    return record
+
+
+def lookup_many(session, keys):
+    """Stored rows for several keys as {key: IdempotencyKey}; expired rows are deleted"""
+    if not keys:
+        return {}
+    now = datetime.utcnow()
+    found = {}
+    for record in session.query(IdempotencyKey).filter(IdempotencyKey.key.in_(keys)):
+        if record.expires_at < now:
+            session.delete(record)
+        else:
+            found[record.key] = record
+    session.flush()
+    return found
+
+
+def new_record(key, request_hash, ttl):
+    """Unsaved IdempotencyKey row; the caller fills in the response before commit"""
+    now = datetime.utcnow()
+    return IdempotencyKey(
+        key=key,
+        request_hash=request_hash,
+        response_status=0,
+        response_body={},
+        created_at=now,
+        expires_at=now + timedelta(seconds=ttl),
+    )
+
+
+def purge_expired():
+    """Delete expired keys. Returns the number of rows removed"""
+    session = get_session()
+    try:
+        count = session.query(IdempotencyKey).filter(
+            IdempotencyKey.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        session.commit()
+        return count
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def start_purger(interval):
+    """Run purge_expired() every `interval` seconds on a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                count = purge_expired()
+                if count:
+                    print(f"✓ Purged {count} expired idempotency keys", flush=True)
+            except Exception as e:
+                print(f"✗ Idempotency key purge failed: {e}", flush=True)
+
+    thread = threading.Thread(target=loop, name='idempotency-purger', daemon=True)
+    thread.start()
+    return thread
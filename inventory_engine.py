@@ -0,0 +1,301 @@
+"""
+Columnar in-memory copy of the tire inventory for facets and aggregates.
+
+Tires are held as parallel columns (id, quantity, price, size code, brand
+code) with size and brand dictionary-encoded. Columns are array.array
+buffers; with NumPy installed they are viewed without copying and each facet
+query is a handful of vectorized mask/bincount operations, otherwise a plain
+Python loop computes the same result.
+
+The engine is marked dirty through cache.on_inventory_change and re-reads
+only the tires the writer reported, plus rows whose updated_at moved since
+its last sync. A full rebuild happens on first use, after a change to
+unknown rows (imports, bulk edits), when the row count no longer matches,
+and periodically as a safety net.
+
+Loads read the database without holding the lock that queries take: a
+rebuild fills a new set of columns and swaps it in, a sync fetches its rows
+first and applies them in one short critical section. While one thread
+loads, others keep answering from the current columns.
+"""
+
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func
+
+from models import Tire
+
+try:
+    import numpy as np
+except ImportError:  # Optional: falls back to Python loops
+    np = None
+
+LOAD_BATCH = 10000
+
+
+class _Columns:
+    """One copy of the inventory as parallel, dictionary-encoded columns"""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.qty = array('q')
+        self.price = array('d')
+        self.size_code = array('i')
+        self.brand_code = array('i')
+        self.sizes = []
+        self.brands = []
+        self._size_lookup = {}
+        self._brand_lookup = {}
+        self._pos = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _encode(self, values, lookup, value):
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(values)
+            values.append(value)
+        return code
+
+    def apply(self, tire_id, size, brand, quantity, price):
+        size_code = self._encode(self.sizes, self._size_lookup, size or '')
+        brand_code = self._encode(self.brands, self._brand_lookup, brand or '')
+        idx = self._pos.get(tire_id)
+        if idx is None:
+            self._pos[tire_id] = len(self.ids)
+            self.ids.append(tire_id)
+            self.qty.append(quantity or 0)
+            self.price.append(price or 0.0)
+            self.size_code.append(size_code)
+            self.brand_code.append(brand_code)
+        else:
+            self.qty[idx] = quantity or 0
+            self.price[idx] = price or 0.0
+            self.size_code[idx] = size_code
+            self.brand_code[idx] = brand_code
+
+
+class InventoryEngine:
+
+    def __init__(self, session_factory, full_rebuild_interval=600, sync_overlap=5):
+        self.session_factory = session_factory
+        self.full_rebuild_interval = full_rebuild_interval
+        # Re-read rows changed slightly before the last sync, in case a
+        # transaction committed late with an earlier updated_at
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        # Held by queries and for swapping in / applying loaded rows
+        self._lock = threading.Lock()
+        # Held for a whole rebuild or sync, so only one thread loads at a time
+        self._load_lock = threading.Lock()
+        # Tires reported changed since the last sync; guarded separately so
+        # writers never wait for a rebuild
+        self._pending_lock = threading.Lock()
+        self._pending_ids = set()
+        self._needs_rebuild = False
+        self._dirty = True
+        self._built = False
+        self._last_sync = None
+        self._last_full = 0.0
+        self.stats = {'full_rebuilds': 0, 'incremental_syncs': 0, 'rows_applied': 0}
+        self.columns = _Columns()
+
+    def __len__(self):
+        return len(self.columns)
+
+    # Loading
+
+    def mark_dirty(self, version=None, tire_ids=None):
+        """Inventory changed; sync before the next query. `tire_ids` are
+        re-read by id, whenever their updated_at says they changed; None
+        (changed rows unknown) means rebuild."""
+        with self._pending_lock:
+            if tire_ids is None:
+                self._needs_rebuild = True
+            else:
+                self._pending_ids.update(tire_ids)
+            self._dirty = True
+
+    def _take_pending(self):
+        with self._pending_lock:
+            ids, self._pending_ids = self._pending_ids, set()
+            self._needs_rebuild = False
+            self._dirty = False
+        return ids
+
+    def _select_columns(self):
+        return select(Tire.id, Tire.size, Tire.brand, Tire.quantity, Tire.price)
+
+    def rebuild(self):
+        """Reload every tire from the database"""
+        with self._load_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        self._take_pending()
+        sync_start = datetime.utcnow()
+        columns = _Columns()
+        session = self.session_factory()
+        try:
+            stmt = self._select_columns().order_by(Tire.id).execution_options(yield_per=LOAD_BATCH)
+            for row in session.execute(stmt):
+                columns.apply(*row)
+        finally:
+            session.close()
+        with self._lock:
+            self.columns = columns
+        self._built = True
+        self._last_sync = sync_start
+        self._last_full = time.monotonic()
+        self.stats['full_rebuilds'] += 1
+
+    def sync(self):
+        """Apply tires reported changed, plus any with a recent updated_at.
+        updated_at alone can miss rows: it's set at flush, so a long
+        transaction (a big CSV import) can commit rows stamped well before
+        the last sync."""
+        with self._load_lock:
+            self._sync()
+
+    def _sync(self):
+        pending = sorted(self._take_pending())
+        sync_start = datetime.utcnow()
+        session = self.session_factory()
+        try:
+            stmt = self._select_columns().where(Tire.updated_at >= self._last_sync - self.sync_overlap)
+            rows = session.execute(stmt).all()
+            for i in range(0, len(pending), LOAD_BATCH):
+                chunk = pending[i:i + LOAD_BATCH]
+                rows.extend(session.execute(self._select_columns().where(Tire.id.in_(chunk))))
+            total = session.execute(select(func.count(Tire.id))).scalar()
+        finally:
+            session.close()
+        with self._lock:
+            for row in rows:
+                self.columns.apply(*row)
+            count = len(self.columns)
+        self.stats['incremental_syncs'] += 1
+        self.stats['rows_applied'] += len(rows)
+        if total != count:
+            # Rows were deleted, or a change slipped past updated_at
+            self._rebuild()
+            return
+        self._last_sync = sync_start
+
+    def refresh(self):
+        # Once built, don't wait for another thread's load; answer from the
+        # columns as they are
+        if not self._load_lock.acquire(blocking=not self._built):
+            return
+        try:
+            if (not self._built or self._needs_rebuild
+                    or time.monotonic() - self._last_full > self.full_rebuild_interval):
+                self._rebuild()
+            elif self._dirty:
+                self._sync()
+        finally:
+            self._load_lock.release()
+
+    # Queries
+
+    def _matching_codes(self, values, predicate):
+        return [code for code, value in enumerate(values) if predicate(value)]
+
+    def facets(self, size=None, size_like=None, brand=None, min_qty=None, in_stock=False,
+               include_value=False):
+        """Filter tires and aggregate the matches by size and by brand.
+
+        - `size`: exact size, `size_like`: case-insensitive substring (e.g. "R17")
+        - `brand`: case-insensitive exact brand
+        - `min_qty` / `in_stock`: quantity filters
+        Each group reports listings (rows) and quantity; with `include_value`
+        also quantity * price."""
+        self.refresh()
+        with self._lock:
+            columns = self.columns
+            size_codes = None
+            if size is not None:
+                size_codes = self._matching_codes(columns.sizes, lambda s: s == size)
+            if size_like:
+                pattern = size_like.upper()
+                like_codes = self._matching_codes(columns.sizes, lambda s: pattern in s.upper())
+                size_codes = like_codes if size_codes is None else sorted(set(size_codes) & set(like_codes))
+            brand_codes = None
+            if brand is not None:
+                wanted = brand.strip().lower()
+                brand_codes = self._matching_codes(columns.brands, lambda b: b.strip().lower() == wanted)
+            if in_stock:
+                min_qty = max(min_qty or 0, 1)
+
+            aggregate = self._aggregate_numpy if np is not None else self._aggregate_python
+            by_size, by_brand = aggregate(columns, size_codes, brand_codes, min_qty)
+
+            sizes = self._groups(columns.sizes, by_size, 'size', include_value)
+            brands = self._groups(columns.brands, by_brand, 'brand', include_value)
+            totals = {
+                'listings': sum(g['listings'] for g in sizes),
+                'quantity': sum(g['quantity'] for g in sizes),
+            }
+            if include_value:
+                totals['value'] = round(sum(g['value'] for g in sizes), 2)
+            return {'rows': len(columns), 'totals': totals, 'sizes': sizes, 'brands': brands}
+
+    def _groups(self, names, aggregates, key, include_value):
+        listings, quantity, value = aggregates
+        groups = []
+        for code, name in enumerate(names):
+            if not listings[code]:
+                continue
+            group = {key: name, 'listings': int(listings[code]), 'quantity': int(quantity[code])}
+            if include_value:
+                group['value'] = round(float(value[code]), 2)
+            groups.append(group)
+        return groups
+
+    def _aggregate_numpy(self, columns, size_codes, brand_codes, min_qty):
+        qty = np.frombuffer(columns.qty, dtype=np.int64)
+        price = np.frombuffer(columns.price, dtype=np.float64)
+        size_col = np.frombuffer(columns.size_code, dtype=np.int32)
+        brand_col = np.frombuffer(columns.brand_code, dtype=np.int32)
+
+        mask = np.ones(len(qty), dtype=bool)
+        if size_codes is not None:
+            mask &= np.isin(size_col, size_codes)
+        if brand_codes is not None:
+            mask &= np.isin(brand_col, brand_codes)
+        if min_qty is not None:
+            mask &= qty >= min_qty
+
+        q = qty[mask]
+        v = q * price[mask]
+        s = size_col[mask]
+        b = brand_col[mask]
+        by_size = (np.bincount(s, minlength=len(columns.sizes)),
+                   np.bincount(s, weights=q, minlength=len(columns.sizes)),
+                   np.bincount(s, weights=v, minlength=len(columns.sizes)))
+        by_brand = (np.bincount(b, minlength=len(columns.brands)),
+                    np.bincount(b, weights=q, minlength=len(columns.brands)),
+                    np.bincount(b, weights=v, minlength=len(columns.brands)))
+        return by_size, by_brand
+
+    def _aggregate_python(self, columns, size_codes, brand_codes, min_qty):
+        size_set = set(size_codes) if size_codes is not None else None
+        brand_set = set(brand_codes) if brand_codes is not None else None
+        n_sizes, n_brands = len(columns.sizes), len(columns.brands)
+        by_size = ([0] * n_sizes, [0] * n_sizes, [0.0] * n_sizes)
+        by_brand = ([0] * n_brands, [0] * n_brands, [0.0] * n_brands)
+        for q, p, s, b in zip(columns.qty, columns.price, columns.size_code, columns.brand_code):
+            if size_set is not None and s not in size_set:
+                continue
+            if brand_set is not None and b not in brand_set:
+                continue
+            if min_qty is not None and q < min_qty:
+                continue
+            for groups, code in ((by_size, s), (by_brand, b)):
+                groups[0][code] += 1
+                groups[1][code] += q
+                groups[2][code] += q * p
+        return by_size, by_brand
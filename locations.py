@@ -0,0 +1,192 @@
+"""
+Per-location stock.
+
+A tire with no LocationStock rows keeps using Tire.quantity directly. Once a
+tire is stocked at a location, Tire.quantity is the total over its locations;
+every function here changes the location rows and Tire.quantity together, in
+the caller's transaction, so the catalog can keep reading one column instead
+of summing location rows on each request. Both are changed by deltas applied
+in SQL (never by writing back a value read earlier), so concurrent orders and
+edits keep the total equal to the sum of its location rows.
+"""
+
+from sqlalchemy import select, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import Tire, Location, LocationStock
+
+
+def stock_rows(session, tire_id, lock=False):
+    """LocationStock rows for a tire, lowest location id first"""
+    query = session.query(LocationStock).filter_by(tire_id=tire_id).order_by(LocationStock.location_id)
+    if lock:
+        query = query.with_for_update()
+    return query.all()
+
+
+def tracked_tire_ids(session, tire_ids):
+    """Subset of `tire_ids` that are stocked per location"""
+    if not tire_ids:
+        return set()
+    rows = session.query(LocationStock.tire_id).filter(
+        LocationStock.tire_id.in_(tire_ids)
+    ).distinct()
+    return {tire_id for (tire_id,) in rows}
+
+
+def _add_quantity(session, row, delta, require_stock=False):
+    """Add `delta` to a Tire's or LocationStock's quantity in SQL, so
+    concurrent writers add up instead of overwriting each other with values
+    they read earlier. With `require_stock` a decrease only applies if that
+    much is left. Returns False (and changes nothing) when it isn't."""
+    model = type(row)
+    if row.id is None:
+        session.flush()
+    stmt = update(model).where(model.id == row.id)
+    if require_stock and delta < 0:
+        stmt = stmt.where(model.quantity >= -delta)
+    new_qty = session.execute(
+        stmt.values(quantity=model.quantity + delta)
+        .returning(model.quantity)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if new_qty is None:
+        return False
+    set_committed_value(row, 'quantity', new_qty)
+    session.expire(row, ['updated_at'])
+    return True
+
+
+def lock_tire(session, tire):
+    """Row-lock a tire (PostgreSQL) and reload it, so writers changing its
+    stock take turns. Order submission locks its tires when quoting."""
+    return session.query(Tire).filter_by(id=tire.id).populate_existing().with_for_update().one()
+
+
+def allocate(session, tire, qty, preferred_location_id=None, tracked=None):
+    """Take `qty` of `tire` out of stock.
+    Draws from the preferred location first, then from the locations holding
+    the most. Returns (taken, allocations) where allocations is a list of
+    {'locationId', 'quantity'} to record on the order item; taken is less
+    than `qty` only if the stock ran out, including to a concurrent order.
+    Pass `tracked` when the caller already knows whether the tire has
+    location rows."""
+    rows = stock_rows(session, tire.id, lock=True) if tracked is not False else []
+    if not rows:
+        if qty <= 0 or not _add_quantity(session, tire, -qty, require_stock=True):
+            return 0, []
+        return qty, []
+
+    rows.sort(key=lambda r: (r.location_id != preferred_location_id, -r.quantity))
+    remaining = qty
+    allocations = []
+    for row in rows:
+        if remaining <= 0:
+            break
+        take = min(row.quantity, remaining)
+        if take <= 0 or not _add_quantity(session, row, -take, require_stock=True):
+            continue
+        remaining -= take
+        allocations.append({'locationId': row.location_id, 'quantity': take})
+
+    taken = qty - remaining
+    if taken:
+        _add_quantity(session, tire, -taken)
+    return taken, allocations
+
+
+def restore(session, tire, qty, allocations=None):
+    """Put stock taken by allocate() back where it came from"""
+    if not allocations:
+        _add_quantity(session, tire, qty)
+        return
+    tire = lock_tire(session, tire)
+    rows = {r.location_id: r for r in stock_rows(session, tire.id, lock=True)}
+    for allocation in allocations:
+        row = rows.get(allocation['locationId'])
+        if row is None:
+            row = LocationStock(location_id=allocation['locationId'], tire_id=tire.id, quantity=0)
+            session.add(row)
+            rows[row.location_id] = row
+        _add_quantity(session, row, allocation['quantity'])
+        _add_quantity(session, tire, allocation['quantity'])
+
+
+def set_location_quantity(session, tire, location_id, qty):
+    """Set the stock of `tire` at one location and update the tire's total.
+    Returns (row, discarded). The first location row for a tire starts out
+    holding the tire's untracked quantity, so setting it lower drops the
+    difference; `discarded` is that amount (always 0 once tracked)."""
+    tire = lock_tire(session, tire)
+    rows = stock_rows(session, tire.id, lock=True)
+    row = next((r for r in rows if r.location_id == location_id), None)
+    discarded = 0
+    if row is None:
+        seed = 0 if rows else tire.quantity
+        discarded = max(0, seed - qty)
+        row = LocationStock(location_id=location_id, tire_id=tire.id, quantity=seed)
+        session.add(row)
+        session.flush()
+    # Change the total by the row's difference as the database sees it, in
+    # the same statement, so a concurrent order on this row can't be lost
+    current = select(LocationStock.quantity).where(LocationStock.id == row.id).scalar_subquery()
+    new_total = session.execute(
+        update(Tire).where(Tire.id == tire.id)
+        .values(quantity=Tire.quantity + (qty - current))
+        .returning(Tire.quantity)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    set_committed_value(tire, 'quantity', new_total)
+    session.expire(tire, ['updated_at'])
+    session.execute(
+        update(LocationStock).where(LocationStock.id == row.id).values(quantity=qty)
+        .execution_options(synchronize_session=False)
+    )
+    set_committed_value(row, 'quantity', qty)
+    session.expire(row, ['updated_at'])
+    return row, discarded
+
+
+def set_total(session, tire, qty, tracked=None):
+    """Set a tire's total quantity, e.g. from the admin editor or a CSV import.
+    For location-tracked tires an increase goes to the first location and a
+    decrease is taken like an order would. Pass `tracked` when the caller
+    already knows whether the tire has location rows."""
+    if tracked is None:
+        tracked = bool(stock_rows(session, tire.id))
+    if not tracked:
+        tire.quantity = qty
+        return
+    tire = lock_tire(session, tire)
+    delta = qty - tire.quantity
+    if delta > 0:
+        row = stock_rows(session, tire.id, lock=True)[0]
+        _add_quantity(session, row, delta)
+        _add_quantity(session, tire, delta)
+    elif delta < 0:
+        allocate(session, tire, -delta, tracked=True)
+
+
+def location_inventory(session, location_id):
+    """Tires in stock at a location, using the (location_id, tire_id) index"""
+    rows = session.query(Tire, LocationStock.quantity).join(
+        LocationStock, LocationStock.tire_id == Tire.id
+    ).filter(
+        LocationStock.location_id == location_id,
+        LocationStock.quantity > 0
+    ).order_by(Tire.id)
+    result = []
+    for tire, location_qty in rows:
+        data = tire.to_dict()
+        data['location_id'] = location_id
+        data['location_quantity'] = location_qty
+        result.append(data)
+    return result
+
+
+def tire_locations(session, tire_id):
+    """Per-location stock for one tire"""
+    rows = session.query(LocationStock, Location.name).join(
+        Location, Location.id == LocationStock.location_id
+    ).filter(LocationStock.tire_id == tire_id).order_by(Location.name)
+    return [dict(row.to_dict(), name=name) for row, name in rows]
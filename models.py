@@ -3,14 +3,20 @@ Database models for tire inventory and order management.
 Uses SQLAlchemy ORM - compatible with SQLite (local) and PostgreSQL (production).
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, JSON, LargeBinary, ForeignKey, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+import json
 import os
+import zlib
 
 Base = declarative_base()
 
+# PostgreSQL connection pool sizing (also used by the server's admission control)
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+
 class Tire(Base):
     """Tire inventory model"""
     __tablename__ = 'tires'
@@ -18,11 +24,14 @@ class Tire(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     brand = Column(String(100), nullable=False)
     size = Column(String(50), nullable=False)
+    # Total available. For tires stocked per location this is the sum of their
+    # LocationStock rows, kept in step by locations.py
     quantity = Column(Integer, nullable=False, default=0)
     price = Column(Float, nullable=False)
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Indexed: the inventory engine syncs rows changed since its last pass
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     def to_dict(self):
         """Convert tire object to dictionary"""
@@ -37,6 +46,44 @@ class Tire(Base):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class Location(Base):
+    """A yard or shop that holds stock"""
+    __tablename__ = 'locations'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), nullable=False, unique=True)
+    address = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert location object to dictionary"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'address': self.address
+        }
+
+class LocationStock(Base):
+    """Quantity of one tire held at one location"""
+    __tablename__ = 'location_stock'
+    __table_args__ = (
+        UniqueConstraint('location_id', 'tire_id', name='uq_location_stock_location_tire'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    location_id = Column(Integer, ForeignKey('locations.id'), nullable=False)
+    tire_id = Column(Integer, ForeignKey('tires.id'), nullable=False, index=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert stock row to dictionary"""
+        return {
+            'locationId': self.location_id,
+            'tireId': self.tire_id,
+            'quantity': self.quantity
+        }
+
 class Order(Base):
     """Order model"""
     __tablename__ = 'orders'
@@ -73,6 +120,53 @@ class Order(Base):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class ArchivedOrder(Base):
+    """Cold storage for closed orders moved out of the orders table.
+    Lookup/search columns are kept as plain indexed columns; the full order
+    is stored as zlib-compressed JSON in `payload`."""
+    __tablename__ = 'order_archive'
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)  # Same id as the original order
+    timestamp = Column(DateTime, nullable=False, index=True)
+    customer_name = Column(String(200), nullable=False)
+    customer_email = Column(String(200), nullable=False, index=True)
+    customer_phone = Column(String(50), nullable=False)
+    status = Column(String(50), nullable=False)
+    total = Column(Float, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    @classmethod
+    def from_order(cls, order):
+        """Build an archive row from an Order"""
+        return cls(
+            id=order.id,
+            timestamp=order.timestamp,
+            customer_name=order.customer_name,
+            customer_email=order.customer_email,
+            customer_phone=order.customer_phone,
+            status=order.status,
+            total=order.total,
+            payload=zlib.compress(json.dumps(order.to_dict()).encode(), 9)
+        )
+    
+    def to_dict(self):
+        """Decompress the stored order (same shape as Order.to_dict)"""
+        data = json.loads(zlib.decompress(self.payload))
+        data['archived'] = True
+        return data
+
+class IdempotencyKey(Base):
+    """Stored result of a request made with an Idempotency-Key header"""
+    __tablename__ = 'idempotency_keys'
+    
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)  # Fingerprint of the original request body
+    response_status = Column(Integer, nullable=False)
+    response_body = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 # Database connection setup
 def get_database_url():
     """Get database URL from environment or use SQLite for local development"""
@@ -97,8 +191,8 @@ def init_db():
         engine = create_engine(
             db_url, 
             echo=False,
-            pool_size=5,
-            max_overflow=10,
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
             pool_timeout=30,
             pool_recycle=3600,
             pool_pre_ping=True,  # Verify connections before using
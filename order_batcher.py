@@ -0,0 +1,163 @@
+"""
+Group commit for order submissions.
+
+Concurrent /api/submit-order calls hand their order to a single writer
+thread, which collects submissions for a short window and writes the whole
+batch in one transaction: tires for every order are loaded (and row-locked)
+in one query, each order is priced and its stock taken against those rows in
+turn, and everything is committed once. Each caller gets its own Outcome; an
+order whose stock ran out is rejected without affecting the others.
+
+If the batch transaction fails as a whole (e.g. an Idempotency-Key committed
+concurrently by another process), its orders are retried one transaction each.
+
+With a profiler, the SQL of each batch is reported back to every request in
+it, since none of it runs on the request threads.
+"""
+
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+import idempotency
+import locations
+import orders
+import quotes
+from models import get_session, Tire
+
+
+class _Pending:
+    __slots__ = ('order_data', 'idem_key', 'request_hash', 'trace', 'done', 'outcome', 'error')
+
+    def __init__(self, order_data, idem_key, request_hash, trace=None):
+        self.order_data = order_data
+        self.idem_key = idem_key
+        self.request_hash = request_hash
+        self.trace = trace
+        self.done = threading.Event()
+        self.outcome = None
+        self.error = None
+
+
+class OrderBatcher:
+
+    def __init__(self, window_ms=5, max_batch=50, idempotency_ttl=86400, timeout=30, profiler=None):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.idempotency_ttl = idempotency_ttl
+        self.timeout = timeout
+        self.profiler = profiler
+        self._queue = queue.Queue()
+        self.stats = {'batches': 0, 'orders': 0, 'largest_batch': 0, 'fallbacks': 0}
+        self._thread = threading.Thread(target=self._run, name='order-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, order_data, idem_key=None, request_hash=None):
+        """Queue an order and wait for its Outcome (same contract as orders.place_order)"""
+        trace = self.profiler.current_trace() if self.profiler else None
+        pending = _Pending(order_data, idem_key, request_hash, trace)
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            raise TimeoutError('Order was not written in time')
+        if pending.error is not None:
+            raise pending.error
+        return pending.outcome
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            tracing = self.profiler.trace_into([p.trace for p in batch]) if self.profiler else nullcontext()
+            try:
+                with tracing:
+                    self._process(batch)
+            finally:
+                # Wake the callers only once the batch's SQL is in their traces
+                for pending in batch:
+                    pending.done.set()
+
+    def _process(self, batch):
+        try:
+            outcomes = self._write_batch(batch)
+        except Exception as e:
+            print(f"⚠ Order batch of {len(batch)} failed ({e}); writing individually", flush=True)
+            self.stats['fallbacks'] += 1
+            outcomes = None
+
+        for i, pending in enumerate(batch):
+            if outcomes is not None:
+                pending.outcome = outcomes[i]
+            else:
+                try:
+                    pending.outcome = orders.place_order(
+                        pending.order_data, pending.idem_key, pending.request_hash, self.idempotency_ttl
+                    )
+                except Exception as e:
+                    pending.error = e
+
+    def _write_batch(self, batch):
+        session = get_session()
+        try:
+            outcomes = [None] * len(batch)
+
+            keys = [p.idem_key for p in batch if p.idem_key]
+            existing = idempotency.lookup_many(session, keys)
+
+            # One locking read of every tire in the batch, in id order
+            tire_ids = {int(item['id']) for p in batch for item in p.order_data.get('items', [])}
+            tires = {}
+            if tire_ids:
+                rows = session.query(Tire).filter(Tire.id.in_(tire_ids)).order_by(Tire.id).with_for_update()
+                tires = {t.id: t for t in rows}
+            tracked = locations.tracked_tire_ids(session, list(tires))
+
+            created = []
+            for i, pending in enumerate(batch):
+                if pending.idem_key in existing:
+                    outcomes[i] = orders.replayed(existing[pending.idem_key])
+                    continue
+                try:
+                    order = orders.build_order(session, pending.order_data, tires, tracked)
+                except orders.AllocationFailed:
+                    # Stock was partly taken for this order; can't undo it alone
+                    raise
+                except quotes.StaleCart as e:
+                    # Nothing was written for this order
+                    outcomes[i] = orders.rejected(e)
+                    continue
+                record = None
+                if pending.idem_key:
+                    record = idempotency.new_record(pending.idem_key, pending.request_hash, self.idempotency_ttl)
+                    session.add(record)
+                created.append((i, pending, order, record))
+
+            session.flush()
+            for i, pending, order, record in created:
+                pending.order_data['id'] = order.id
+                body = orders.created_body(order.id)
+                if record is not None:
+                    record.response_status = 200
+                    record.response_body = body
+                outcomes[i] = orders.Outcome('created', 200, body)
+
+            session.commit()
+            self.stats['batches'] += 1
+            self.stats['orders'] += len(batch)
+            self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+            if created:
+                print(f"📦 Committed batch: {len(created)} orders ({len(batch)} submissions)", flush=True)
+            return outcomes
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
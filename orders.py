@@ -0,0 +1,145 @@
+"""
+Order creation, shared by the one-transaction-per-request path and the
+group-commit batcher (order_batcher.py).
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+import idempotency
+import locations
+import quotes
+from models import get_session, Tire, Order
+
+# kind: 'created', 'replayed' (stored Idempotency-Key response) or 'rejected'
+# request_hash: for replays, the fingerprint stored with the key
+Outcome = namedtuple('Outcome', ['kind', 'status', 'body', 'request_hash'], defaults=(None,))
+
+
+class AllocationFailed(quotes.StaleCart):
+    """Stock ran out between the quote and taking it (a concurrent writer won)"""
+
+
+def created_body(order_id):
+    return {
+        'success': True,
+        'message': 'Order placed successfully',
+        'orderId': order_id
+    }
+
+
+def rejected(error):
+    return Outcome('rejected', 409, {'success': False, 'message': str(error), 'quote': error.quote})
+
+
+def replayed(record):
+    return Outcome('replayed', record.response_status, record.response_body, record.request_hash)
+
+
+def build_order(session, order_data, tires=None, tracked=None):
+    """Price the cart, take the stock and add a new Order to the session
+    (unflushed). `tires` (id -> Tire) and `tracked` (location-tracked ids)
+    let a batch reuse rows loaded once for all of its orders.
+    Raises StaleCart before writing anything if the cart is stale."""
+    order_timestamp = datetime.utcnow()
+    order_data['timestamp'] = order_timestamp.isoformat() + 'Z'
+    order_data['status'] = 'pending'
+
+    # Re-price the cart from current data; stale carts stop here
+    quotes.check_order(session, order_data, tires)
+
+    # Take stock before the order row is built so each item's location
+    # allocations are saved with it
+    for order_item in order_data['items']:
+        # Only ever set here; never trust a client-supplied (or stale) value
+        order_item.pop('allocations', None)
+        if tires is not None:
+            tire = tires.get(int(order_item['id']))
+        else:
+            tire = session.query(Tire).filter_by(id=order_item['id']).first()
+        if tire:
+            old_qty = tire.quantity
+            try:
+                # The location the shopper picked in the catalog, if any
+                preferred = int(order_item['location_id']) if order_item.get('location_id') else None
+            except (TypeError, ValueError):
+                preferred = None
+            taken, allocations = locations.allocate(
+                session, tire, order_item['selected_qty'], preferred,
+                tracked=(tire.id in tracked) if tracked is not None else None
+            )
+            if taken < order_item['selected_qty']:
+                # Re-quote so the client sees the stock that's actually left
+                fresh = quotes.quote(session, quotes.parse_lines(order_data['items']), lock=True)
+                raise AllocationFailed('Some items in your cart are no longer available', fresh)
+            if allocations:
+                order_item['allocations'] = allocations
+            print(f"📦 Updated tire {tire.id}: {old_qty} → {tire.quantity}", flush=True)
+
+    customer = order_data.get('customer', {})
+    new_order = Order(
+        timestamp=order_timestamp,
+        customer_name=f"{customer.get('firstName', '')} {customer.get('lastName', '')}".strip(),
+        customer_email=customer.get('email', ''),
+        customer_phone=customer.get('phone', ''),
+        order_type=order_data.get('orderType', 'pickup'),
+        items=order_data.get('items', []),
+        total=order_data.get('total', 0.0),
+        notes=order_data.get('notes', ''),
+        status='pending'
+    )
+    session.add(new_order)
+    return new_order
+
+
+def place_order(order_data, idem_key=None, request_hash=None, idempotency_ttl=86400):
+    """Write one order in its own transaction. Returns an Outcome"""
+    session = get_session()
+    try:
+        idem_record = None
+        if idem_key:
+            existing = idempotency.lookup(session, idem_key)
+            if existing:
+                return replayed(existing)
+            # Claim the key first: a concurrent duplicate in another process
+            # blocks on (or fails) this insert instead of writing a second order
+            idem_record = idempotency.new_record(idem_key, request_hash, idempotency_ttl)
+            session.add(idem_record)
+            session.flush()
+
+        print(f"📦 Creating order for: {order_data.get('customer', {}).get('email', 'unknown')}", flush=True)
+        new_order = build_order(session, order_data)
+        session.flush()  # Get the ID
+        order_data['id'] = new_order.id
+
+        body = created_body(new_order.id)
+        if idem_record is not None:
+            # Stored in the same transaction as the order itself
+            idem_record.response_status = 200
+            idem_record.response_body = body
+
+        session.commit()
+        print(f"📦 Order {new_order.id} committed", flush=True)
+        return Outcome('created', 200, body)
+
+    except quotes.StaleCart as e:
+        session.rollback()
+        print(f"⚠ Order rejected: {e}", flush=True)
+        return rejected(e)
+    except IntegrityError:
+        session.rollback()
+        if not idem_key:
+            raise
+        # Another process committed this key first; answer with its response
+        existing = idempotency.lookup(session, idem_key)
+        if not existing:
+            raise
+        return replayed(existing)
+    except Exception as e:
+        print(f"✗ Database error during order creation: {e}", flush=True)
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -0,0 +1,230 @@
+"""
+On-demand request profiling and slow-request capture.
+
+- A configurable fraction of requests to chosen routes run under cProfile.
+- Any request slower than a threshold is captured with the SQL statements it
+  ran and their timings (from SQLAlchemy cursor events on the engine).
+  Work handed to another thread (the order batcher) can report its SQL back
+  to the requests it served with current_trace() and trace_into().
+
+Captures go into a bounded in-memory ring buffer, readable as JSON or as
+pstats data (the format written by cProfile's dump_stats).
+"""
+
+import collections
+import cProfile
+import itertools
+import marshal
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+
+MAX_QUERIES_PER_REQUEST = 200
+MAX_SQL_LENGTH = 2000
+TOP_FUNCTIONS = 30
+
+
+class _Trace:
+    """SQL statements run on behalf of one request"""
+    __slots__ = ('queries', 'sql_ms', 'sql_count', 'query_start')
+
+    def __init__(self):
+        self.queries = []
+        self.sql_ms = 0.0
+        self.sql_count = 0
+        self.query_start = 0.0
+
+    def add(self, query, ms):
+        self.sql_ms += ms
+        self.sql_count += 1
+        if len(self.queries) < MAX_QUERIES_PER_REQUEST:
+            self.queries.append(query)
+
+
+class RequestProfiler:
+
+    def __init__(self, engine, sample_rate=0.0, routes=(), slow_ms=1000, capacity=50):
+        self.engine = engine
+        self.sample_rate = sample_rate
+        self.routes = set(routes)
+        self.slow_ms = slow_ms
+        self.captures = collections.deque(maxlen=capacity)
+        self.requests_seen = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Only one cProfile may run at a time (newer Pythons refuse a second one)
+        self._cprofile_lock = threading.Lock()
+        self._installed = False
+
+    def install(self):
+        """Attach the SQL timing listeners to the engine"""
+        if self._installed:
+            return
+        event.listen(self.engine, 'before_cursor_execute', self._before_execute)
+        event.listen(self.engine, 'after_cursor_execute', self._after_execute)
+        self._installed = True
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace.query_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return
+        elapsed = (time.perf_counter() - trace.query_start) * 1000
+        trace.add({
+            'sql': statement[:MAX_SQL_LENGTH],
+            'ms': round(elapsed, 3),
+            'executemany': executemany,
+        }, elapsed)
+
+    def current_trace(self):
+        """The calling request's SQL trace, or None if it isn't being traced.
+        Pass it to the thread doing the request's work (see trace_into)."""
+        return getattr(self._local, 'trace', None)
+
+    @contextmanager
+    def trace_into(self, traces):
+        """Record the enclosed SQL, run on this thread for several requests at
+        once (an order batch), into each of their traces. The statements are
+        shared, so each copy is marked with the number of requests served."""
+        traces = [t for t in traces if t is not None]
+        if not traces:
+            yield
+            return
+        shared = _Trace()
+        self._local.trace = shared
+        try:
+            yield
+        finally:
+            self._local.trace = None
+            for trace in traces:
+                trace.sql_ms += shared.sql_ms
+                trace.sql_count += shared.sql_count
+                for query in shared.queries:
+                    if len(trace.queries) >= MAX_QUERIES_PER_REQUEST:
+                        break
+                    trace.queries.append(dict(query, sharedBy=len(traces)))
+
+    def configure(self, sample_rate=None, routes=None, slow_ms=None):
+        if routes is not None and (not isinstance(routes, (list, tuple))
+                                   or not all(isinstance(r, str) for r in routes)):
+            raise ValueError('routes must be a list of paths')
+        sample_rate = None if sample_rate is None else max(0.0, min(1.0, float(sample_rate)))
+        slow_ms = None if slow_ms is None else max(0, int(slow_ms))
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if routes is not None:
+                self.routes = set(routes)
+            if slow_ms is not None:
+                self.slow_ms = slow_ms
+
+    def settings(self):
+        return {
+            'sampleRate': self.sample_rate,
+            'routes': sorted(self.routes),
+            'slowMs': self.slow_ms,
+            'capacity': self.captures.maxlen,
+            'requestsSeen': self.requests_seen,
+        }
+
+    @contextmanager
+    def track(self, method, path):
+        """Time the enclosed request; profile it if sampled, keep it if slow"""
+        self.requests_seen += 1
+        profile = None
+        if path in self.routes and self.sample_rate > 0 and random.random() < self.sample_rate:
+            if self._cprofile_lock.acquire(blocking=False):
+                profile = cProfile.Profile()
+
+        local = self._local
+        local.trace = _Trace() if self.slow_ms > 0 or profile else None
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                self._cprofile_lock.release()
+            duration_ms = (time.perf_counter() - start) * 1000
+            trace = local.trace or _Trace()
+            local.trace = None
+
+            slow = self.slow_ms > 0 and duration_ms >= self.slow_ms
+            if profile or slow:
+                self._record(method, path, started_at, duration_ms, trace.queries,
+                             trace.sql_ms, trace.sql_count, profile,
+                             'sampled' if profile else 'slow')
+
+    def _record(self, method, path, started_at, duration_ms, queries, sql_ms, sql_count, profile, reason):
+        capture = {
+            'id': next(self._ids),
+            'method': method,
+            'path': path,
+            'reason': reason,
+            'startedAt': started_at.isoformat() + 'Z',
+            'durationMs': round(duration_ms, 3),
+            'sqlMs': round(sql_ms, 3),
+            'sqlCount': sql_count,
+            'queries': queries,
+            'pstats': None,
+            'topFunctions': [],
+        }
+        if profile:
+            stats = pstats.Stats(profile)
+            capture['pstats'] = marshal.dumps(stats.stats)
+            capture['topFunctions'] = top_functions(stats)
+        with self._lock:
+            self.captures.append(capture)
+
+    def list_captures(self):
+        """Capture summaries, newest first"""
+        with self._lock:
+            captures = list(self.captures)
+        return [{k: v for k, v in c.items() if k not in ('queries', 'pstats', 'topFunctions')}
+                | {'hasProfile': c['pstats'] is not None}
+                for c in reversed(captures)]
+
+    def get_capture(self, capture_id):
+        with self._lock:
+            for capture in self.captures:
+                if capture['id'] == capture_id:
+                    return capture
+        return None
+
+    def clear(self):
+        with self._lock:
+            self.captures.clear()
+
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    """Most expensive functions by cumulative time"""
+    rows = []
+    for (filename, line, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+        rows.append({
+            'function': f'{filename}:{line}({name})',
+            'calls': nc,
+            'totalMs': round(tt * 1000, 3),
+            'cumulativeMs': round(ct * 1000, 3),
+        })
+    rows.sort(key=lambda r: r['cumulativeMs'], reverse=True)
+    return rows[:limit]
+
+
+def capture_json(capture):
+    """JSON-safe copy of a capture (pstats bytes omitted)"""
+    data = {k: v for k, v in capture.items() if k != 'pstats'}
+    data['hasProfile'] = capture['pstats'] is not None
+    return data
@@ -0,0 +1,130 @@
+"""
+Server-side cart pricing.
+A quote prices every cart line against the current Tire rows (fetched in one
+query). /api/cart/quote serves quotes from a short-lived cache keyed by
+inventory version; order submission quotes inside its own transaction.
+"""
+
+import math
+
+import cache
+from models import Tire
+
+# Totals within this much of each other are treated as equal
+PRICE_TOLERANCE = 0.005
+
+
+class StaleCart(Exception):
+    """The client's cart no longer matches current prices or stock"""
+
+    def __init__(self, message, quote):
+        super().__init__(message)
+        self.quote = quote
+
+
+def parse_lines(items):
+    """Normalize cart lines ({id, qty} or order items with selected_qty) into
+    a sorted tuple of (tire_id, qty), merging repeated ids"""
+    merged = {}
+    for item in items or []:
+        tire_id = int(item['id'])
+        qty = int(item.get('qty', item.get('selected_qty', 0)))
+        if qty < 0:
+            raise ValueError(f'Invalid quantity for tire {tire_id}')
+        merged[tire_id] = merged.get(tire_id, 0) + qty
+    return tuple(sorted(merged.items()))
+
+
+def quote(session, lines, tires=None, lock=False):
+    """Price `lines` (from parse_lines) against the database, or against
+    `tires` (id -> Tire) when the caller has already loaded them. With
+    `lock`, the rows are locked (in id order) until the caller's transaction
+    ends, so the stock it quotes can't be taken by another order meanwhile."""
+    if tires is None:
+        ids = [tire_id for tire_id, _ in lines]
+        tires = {}
+        if ids:
+            query = session.query(Tire).filter(Tire.id.in_(ids))
+            if lock:
+                query = query.order_by(Tire.id).populate_existing().with_for_update()
+            tires = {t.id: t for t in query}
+
+    items = []
+    total = 0.0
+    count = 0
+    valid = bool(lines)
+    for tire_id, requested in lines:
+        tire = tires.get(tire_id)
+        if tire is None:
+            items.append({'id': tire_id, 'requested': requested, 'quantity': 0,
+                          'available': 0, 'status': 'not_found'})
+            valid = False
+            continue
+        granted = min(requested, max(0, tire.quantity))
+        if granted == requested:
+            status = 'ok'
+        elif granted > 0:
+            status = 'reduced'
+        else:
+            status = 'unavailable'
+        if status != 'ok':
+            valid = False
+        line_total = round(granted * tire.price, 2)
+        items.append({
+            'id': tire.id,
+            'size': tire.size,
+            'brand': tire.brand,
+            'requested': requested,
+            'quantity': granted,
+            'available': tire.quantity,
+            'price': tire.price,
+            'lineTotal': line_total,
+            'status': status,
+        })
+        total += line_total
+        count += granted
+
+    return {'valid': valid, 'items': items, 'tires': count, 'total': round(total, 2)}
+
+
+_quote_cache = cache.VersionedCache(ttl=5)
+
+
+def cached_quote(session, lines):
+    """quote(), reusing a result computed at the same inventory version in the
+    last few seconds"""
+    result = _quote_cache.get(lines)
+    if result is None:
+        version = cache.inventory_version()
+        result = quote(session, lines)
+        result['version'] = version
+        _quote_cache.put(lines, result, version)
+    return result
+
+
+def check_order(session, order_data, tires=None):
+    """Price an order's items against current data before anything is written.
+    Rewrites item prices and the total from the quote; raises StaleCart if a
+    line can't be filled or the client's total doesn't match. The tire rows
+    stay locked for the rest of the transaction, as the batcher's are."""
+    result = quote(session, parse_lines(order_data.get('items')), tires, lock=tires is None)
+    if not result['valid']:
+        raise StaleCart('Some items in your cart are no longer available', result)
+    client_total = order_data.get('total')
+    if client_total is not None:
+        try:
+            client_total = float(client_total)
+        except (TypeError, ValueError):
+            client_total = math.nan
+        # Lines are rounded to cents before summing; also accept the unrounded
+        # sum, so prices with sub-cent precision can't 409 a client forever
+        unrounded = sum(item['quantity'] * item['price'] for item in result['items'])
+        if not math.isfinite(client_total) or all(abs(client_total - expected) > PRICE_TOLERANCE
+                                                  for expected in (result['total'], unrounded)):
+            raise StaleCart('Prices have changed since your cart was loaded', result)
+
+    prices = {item['id']: item['price'] for item in result['items']}
+    for item in order_data['items']:
+        item['price'] = prices[int(item['id'])]
+    order_data['total'] = result['total']
+    return result
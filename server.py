@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 from http.server import HTTPServer, SimpleHTTPRequestHandler, ThreadingHTTPServer
+import io
 import json
+import math
 import os
 import hashlib
 import secrets
@@ -10,8 +12,21 @@ from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
 from base64 import b64encode
 from http.cookies import SimpleCookie
-from urllib.parse import parse_qs
-from models import get_session, Tire, Order
+from urllib.parse import parse_qs, urlparse
+from models import get_session, engine, Tire, Order, Location, POOL_SIZE, MAX_OVERFLOW
+from admission import AdmissionController, RateLimit
+import idempotency
+import archive
+import streaming
+import locations
+import cache
+import quotes
+import bulk
+import profiling
+from inventory_engine import InventoryEngine
+import orders
+from order_batcher import OrderBatcher
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
 load_dotenv()
@@ -27,6 +42,91 @@ SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER)
 ENABLE_EMAIL = bool(SMTP_HOST and SMTP_USER and SMTP_PASSWORD)
 
+# Admission control (rate limits are requests per minute per client IP)
+LOGIN_RATE_PER_MIN = int(os.getenv("LOGIN_RATE_PER_MIN", "5"))
+ORDER_RATE_PER_MIN = int(os.getenv("ORDER_RATE_PER_MIN", "10"))
+API_RATE_PER_MIN = int(os.getenv("API_RATE_PER_MIN", "120"))
+# Default keeps every in-flight API request able to hold a pooled DB connection
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", str(POOL_SIZE + MAX_OVERFLOW)))
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(64 * 1024)))
+MAX_INVENTORY_BODY_BYTES = int(os.getenv("MAX_INVENTORY_BODY_BYTES", str(5 * 1024 * 1024)))
+MAX_IMPORT_BODY_BYTES = int(os.getenv("MAX_IMPORT_BODY_BYTES", str(500 * 1024 * 1024)))
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "30"))
+MAX_CART_LINES = int(os.getenv("MAX_CART_LINES", "100"))
+# Behind a proxy (e.g. Render.com) the client address comes from X-Forwarded-For.
+# Render sets RENDER=true on its services, so trust its load balancer by default there.
+TRUST_PROXY = os.getenv("TRUST_PROXY", os.getenv("RENDER", "")).lower() in ("1", "true", "yes")
+# Number of trusted proxies in front of the server; each appends to X-Forwarded-For
+TRUST_PROXY_HOPS = max(1, int(os.getenv("TRUST_PROXY_HOPS", "1")))
+
+_proxy_warned = False
+
+
+def warn_untrusted_proxy():
+    """Say once that requests arrive through a proxy we don't trust, since
+    every client then shares the proxy's rate limit bucket"""
+    global _proxy_warned
+    if not _proxy_warned:
+        _proxy_warned = True
+        print("⚠ Requests carry X-Forwarded-For but TRUST_PROXY is off - all clients share the "
+              "proxy's rate limit; set TRUST_PROXY=true if this server is behind a proxy", flush=True)
+
+
+admission = AdmissionController(
+    limits={
+        '/api/login': RateLimit(LOGIN_RATE_PER_MIN),
+        '/api/submit-order': RateLimit(ORDER_RATE_PER_MIN),
+    },
+    default_limit=RateLimit(API_RATE_PER_MIN),
+    max_in_flight=MAX_IN_FLIGHT,
+    max_body={
+        '/api/save-inventory': MAX_INVENTORY_BODY_BYTES,
+        '/api/import/inventory.csv': MAX_IMPORT_BODY_BYTES,
+    },
+    default_max_body=MAX_BODY_BYTES,
+)
+
+# Idempotency-Key handling for order submission
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_PURGE_INTERVAL = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+replay_cache = idempotency.ReplayCache(IDEMPOTENCY_TTL)
+
+# Order archival: closed orders older than this many days move to cold storage (0 = off)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", str(6 * 3600)))
+
+# Request profiling: sample a fraction of requests to PROFILE_ROUTES with cProfile,
+# and capture any request slower than SLOW_REQUEST_MS with its SQL (0 = off)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ROUTES = [r.strip() for r in os.getenv("PROFILE_ROUTES", "/api/submit-order,/api/orders").split(",") if r.strip()]
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "1000"))
+PROFILE_CAPACITY = int(os.getenv("PROFILE_CAPACITY", "50"))
+
+profiler = profiling.RequestProfiler(
+    engine,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    routes=PROFILE_ROUTES,
+    slow_ms=SLOW_REQUEST_MS,
+    capacity=PROFILE_CAPACITY,
+)
+profiler.install()
+
+# Group commit: gather concurrent order submissions for ORDER_BATCH_WINDOW_MS and
+# write them in one transaction (off by default)
+ORDER_BATCHING = os.getenv("ORDER_BATCHING", "").lower() in ("1", "true", "yes")
+ORDER_BATCH_WINDOW_MS = int(os.getenv("ORDER_BATCH_WINDOW_MS", "5"))
+ORDER_BATCH_MAX = int(os.getenv("ORDER_BATCH_MAX", "50"))
+order_batcher = OrderBatcher(
+    window_ms=ORDER_BATCH_WINDOW_MS,
+    max_batch=ORDER_BATCH_MAX,
+    idempotency_ttl=IDEMPOTENCY_TTL,
+    profiler=profiler,
+) if ORDER_BATCHING else None
+
+# Columnar inventory copy for /api/inventory/facets, synced after inventory writes
+inventory_engine = InventoryEngine(get_session)
+cache.on_inventory_change(inventory_engine.mark_dirty)
+
 # Store active sessions
 active_sessions = {}
 
@@ -118,6 +218,101 @@ def send_order_confirmation_email(order_data):
 
 class InventoryHandler(SimpleHTTPRequestHandler):
     
+    # Drop connections that stall while sending a request
+    timeout = REQUEST_TIMEOUT
+    
+    def send_json(self, status, payload, headers=None):
+        """Send a JSON response with the given status code"""
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode())
+    
+    def client_ip(self):
+        """Address used as the rate limiting key"""
+        forwarded = self.headers.get('X-Forwarded-For')
+        if forwarded and not TRUST_PROXY:
+            warn_untrusted_proxy()
+        if TRUST_PROXY:
+            if forwarded:
+                # Entries left of what our proxies appended are client-supplied
+                hops = [h.strip() for h in forwarded.split(',') if h.strip()]
+                if hops:
+                    return hops[max(0, len(hops) - TRUST_PROXY_HOPS)]
+        return self.client_address[0]
+    
+    def is_api_request(self):
+        return self.path.startswith('/api/') or self.path == '/data/inventory.json'
+    
+    def admit_request(self):
+        """
+        Apply rate limits, body size limits and the in-flight cap.
+        Returns True if the request should be processed; otherwise an error
+        response has already been sent. A True result must be paired with
+        release_request().
+        """
+        self._admitted = False
+        if not self.is_api_request():
+            return True
+        
+        path = self.path.split('?', 1)[0]
+        
+        wait = admission.check_rate(self.client_ip(), path)
+        if wait:
+            self.close_connection = True
+            self.send_json(429, {'success': False, 'message': 'Too many requests'},
+                           {'Retry-After': str(math.ceil(wait))})
+            print(f"⚠ Rate limited {self.client_ip()} on {path}", flush=True)
+            return False
+        
+        if self.command == 'POST':
+            length_header = self.headers.get('Content-Length')
+            try:
+                content_length = int(length_header)
+            except (TypeError, ValueError):
+                self.close_connection = True
+                self.send_json(411, {'success': False, 'message': 'Content-Length required'})
+                return False
+            if content_length < 0 or not admission.check_body(path, content_length):
+                self.close_connection = True
+                self.send_json(413, {'success': False, 'message': 'Request body too large'})
+                return False
+        
+        if not admission.enter():
+            self.close_connection = True
+            self.send_json(503, {'success': False, 'message': 'Server busy, please retry'},
+                           {'Retry-After': str(admission.retry_after)})
+            print(f"⚠ Shed {self.command} {path} - {admission.max_in_flight} requests in flight", flush=True)
+            return False
+        
+        self._admitted = True
+        return True
+    
+    def release_request(self):
+        if self._admitted:
+            self._admitted = False
+            admission.leave()
+    
+    def start_stream(self, content_type, filename=None):
+        """Send headers for a response of unknown length and return a writer.
+        HTTP/1.1 clients get chunked transfer encoding; the connection is
+        closed afterwards either way."""
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if filename:
+            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        return streaming.ChunkedWriter(self.wfile, chunked)
+    
     def is_authenticated(self):
         """Check if request has valid session cookie"""
         cookie_header = self.headers.get('Cookie')
@@ -137,10 +332,70 @@ class InventoryHandler(SimpleHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Idempotency-Key')
         self.end_headers()
 
+    def send_replay(self, idem_key, request_hash, stored):
+        """Answer a repeated Idempotency-Key with the stored response"""
+        stored_hash, status, body = stored
+        if stored_hash != request_hash:
+            self.send_json(422, {'success': False,
+                                 'message': 'Idempotency-Key was already used for a different request'})
+            return
+        print(f"↺ Replaying response for Idempotency-Key {idem_key}", flush=True)
+        self.send_json(status, body, {'Idempotent-Replayed': 'true'})
+    
+    def submit_order(self, order_data, idem_key=None, request_hash=None):
+        """Create an order and reduce stock, then respond. With an idempotency
+        key, a repeat of an earlier submission gets the original response."""
+        if idem_key:
+            cached = replay_cache.get(idem_key)
+            if cached:
+                self.send_replay(idem_key, request_hash, cached)
+                return
+        
+        if order_batcher is not None:
+            outcome = order_batcher.submit(order_data, idem_key, request_hash)
+        else:
+            outcome = orders.place_order(order_data, idem_key, request_hash, IDEMPOTENCY_TTL)
+        
+        if outcome.kind == 'replayed':
+            stored = (outcome.request_hash, outcome.status, outcome.body)
+            replay_cache.put(idem_key, *stored)
+            self.send_replay(idem_key, request_hash, stored)
+            return
+        if outcome.kind == 'rejected':
+            self.send_json(outcome.status, outcome.body)
+            return
+        
+        cache.invalidate_inventory([int(item['id']) for item in order_data['items']])
+        if idem_key:
+            replay_cache.put(idem_key, request_hash, outcome.status, outcome.body)
+        
+        # Success response
+        self.send_json(outcome.status, outcome.body)
+        
+        print(f"✓ Order #{order_data['id']} placed - ${order_data['total']:.2f}", flush=True)
+        
+        # Send confirmation email (non-blocking)
+        try:
+            send_order_confirmation_email(order_data)
+        except Exception as email_err:
+            print(f"⚠ Email failed (order saved): {email_err}", flush=True)
+    
     def do_POST(self):
+        if not self.admit_request():
+            return
+        try:
+            if self._admitted:
+                with profiler.track(self.command, self.path.split('?', 1)[0]):
+                    self.route_post()
+            else:
+                self.route_post()
+        finally:
+            self.release_request()
+    
+    def route_post(self):
         # Handle login
         if self.path == '/api/login':
             try:
@@ -211,88 +466,15 @@ class InventoryHandler(SimpleHTTPRequestHandler):
                 order_data = json.loads(post_data)
                 print(f"📦 Order data parsed: {len(order_data.get('items', []))} items", flush=True)
                 
-                # Create database session
-                print("📦 Creating database session...", flush=True)
-                session = get_session()
-                print("📦 Database session created successfully", flush=True)
-                
-                try:
-                    # Generate order ID
-                    print("📦 Querying for max order ID...", flush=True)
-                    max_order = session.query(Order).order_by(Order.id.desc()).first()
-                    order_id = (max_order.id + 1) if max_order else 1
-                    print(f"📦 Generated order ID: {order_id}", flush=True)
-                    
-                    # Create timestamp
-                    order_timestamp = datetime.utcnow()
-                    order_data['id'] = order_id
-                    order_data['timestamp'] = order_timestamp.isoformat() + 'Z'
-                    order_data['status'] = 'pending'
-                    
-                    # Create new order
-                    customer = order_data.get('customer', {})
-                    print(f"📦 Creating order for: {customer.get('email', 'unknown')}", flush=True)
-                    new_order = Order(
-                        timestamp=order_timestamp,
-                        customer_name=f"{customer.get('firstName', '')} {customer.get('lastName', '')}".strip(),
-                        customer_email=customer.get('email', ''),
-                        customer_phone=customer.get('phone', ''),
-                        order_type=order_data.get('orderType', 'pickup'),
-                        items=order_data.get('items', []),
-                        total=order_data.get('total', 0.0),
-                        notes=order_data.get('notes', ''),
-                        status='pending'
-                    )
-                    print("📦 Adding order to session...", flush=True)
-                    session.add(new_order)
-                    print("📦 Flushing to get order ID...", flush=True)
-                    session.flush()  # Get the ID
-                    order_data['id'] = new_order.id
-                    print(f"📦 Order created with ID: {new_order.id}", flush=True)
-                    
-                    # Update inventory (reduce quantities)
-                    print(f"📦 Updating inventory for {len(order_data['items'])} items...", flush=True)
-                    for order_item in order_data['items']:
-                        tire = session.query(Tire).filter_by(id=order_item['id']).first()
-                        if tire:
-                            old_qty = tire.quantity
-                            tire.quantity = max(0, tire.quantity - order_item['selected_qty'])
-                            print(f"📦 Updated tire {tire.id}: {old_qty} → {tire.quantity}", flush=True)
-                    
-                    print("📦 Committing transaction...", flush=True)
-                    session.commit()
-                    print("📦 Transaction committed successfully!", flush=True)
-                    
-                    # Success response
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-                    
-                    response = json.dumps({
-                        'success': True, 
-                        'message': 'Order placed successfully',
-                        'orderId': order_data['id']
-                    })
-                    self.wfile.write(response.encode())
-                    
-                    print(f"✓ Order #{order_data['id']} placed - ${order_data['total']:.2f}", flush=True)
-                    
-                    # Send confirmation email (non-blocking)
-                    try:
-                        send_order_confirmation_email(order_data)
-                    except Exception as email_err:
-                        print(f"⚠ Email failed (order saved): {email_err}", flush=True)
-                    
-                except Exception as e:
-                    print(f"✗ Database error during order creation: {e}", flush=True)
-                    import traceback
-                    traceback.print_exc()
-                    session.rollback()
-                    raise e
-                finally:
-                    session.close()
-                    print("📦 Database session closed", flush=True)
+                idem_key = self.headers.get('Idempotency-Key')
+                if idem_key is None:
+                    self.submit_order(order_data)
+                elif not idem_key or len(idem_key) > idempotency.MAX_KEY_LENGTH:
+                    self.send_json(400, {'success': False, 'message': 'Invalid Idempotency-Key'})
+                else:
+                    # Duplicates of this key in this process wait here, then replay
+                    with replay_cache.key_lock(idem_key):
+                        self.submit_order(order_data, idem_key, idempotency.fingerprint(order_data))
                 
             except Exception as e:
                 print(f"✗ Order submission failed: {type(e).__name__}: {e}", flush=True)
@@ -353,12 +535,14 @@ class InventoryHandler(SimpleHTTPRequestHandler):
                     for order_item in order.items:
                         tire = session.query(Tire).filter_by(id=order_item['id']).first()
                         if tire:
-                            tire.quantity += order_item['selected_qty']
+                            locations.restore(session, tire, order_item['selected_qty'],
+                                              order_item.get('allocations'))
                     
                     # Update order status to cancelled
                     order.status = 'cancelled'
                     
                     session.commit()
+                    cache.invalidate_inventory([int(item['id']) for item in order.items])
                     
                     # Success response
                     self.send_response(200)
@@ -459,6 +643,235 @@ class InventoryHandler(SimpleHTTPRequestHandler):
                 self.wfile.write(response.encode())
             return
         
+        # Change profiling settings at runtime (protected)
+        # {"sampleRate": 0.1, "routes": ["/api/orders"], "slowMs": 500}, or {"clear": true}
+        if self.path == '/api/profiling/config':
+            if not self.is_authenticated():
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            try:
+                content_length = int(self.headers['Content-Length'])
+                data = json.loads(self.rfile.read(content_length))
+                profiler.configure(
+                    sample_rate=data.get('sampleRate'),
+                    routes=data.get('routes'),
+                    slow_ms=data.get('slowMs')
+                )
+                if data.get('clear'):
+                    profiler.clear()
+            except (ValueError, TypeError, AttributeError) as e:
+                self.send_json(400, {'success': False, 'message': str(e)})
+                return
+            self.send_json(200, {'success': True, 'settings': profiler.settings()})
+            print(f"✓ Profiling settings: {profiler.settings()}")
+            return
+        
+        # Price a cart against current inventory (public)
+        # {"items": [{"id": 1, "qty": 2}, ...]}
+        if self.path == '/api/cart/quote':
+            try:
+                content_length = int(self.headers['Content-Length'])
+                data = json.loads(self.rfile.read(content_length))
+                lines = quotes.parse_lines(data.get('items'))
+                if len(lines) > MAX_CART_LINES:
+                    self.send_json(400, {'success': False, 'message': f'At most {MAX_CART_LINES} cart lines'})
+                    return
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self.send_json(400, {'success': False, 'message': f'Invalid cart: {e}'})
+                return
+            
+            session = get_session()
+            try:
+                result = quotes.cached_quote(session, lines)
+                self.send_json(200, dict(result, success=True))
+            except Exception as e:
+                print(f"✗ Quote error: {e}")
+                self.send_json(500, {'success': False, 'message': str(e)})
+            finally:
+                session.close()
+            return
+        
+        # Create or rename a location (protected)
+        if self.path == '/api/locations':
+            if not self.is_authenticated():
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            
+            try:
+                content_length = int(self.headers['Content-Length'])
+                data = json.loads(self.rfile.read(content_length))
+                name = str(data.get('name') or '').strip()
+                location_id = int(data['id']) if data.get('id') else None
+            except (ValueError, TypeError, AttributeError) as e:
+                self.send_json(400, {'success': False, 'message': f'Invalid location: {e}'})
+                return
+            if not name:
+                self.send_json(400, {'success': False, 'message': 'Location name is required'})
+                return
+            
+            session = get_session()
+            try:
+                location = session.query(Location).filter_by(id=location_id).first() if location_id else None
+                if location_id and not location:
+                    self.send_json(404, {'success': False, 'message': 'Location not found'})
+                    return
+                if location is None:
+                    location = Location()
+                    session.add(location)
+                location.name = name
+                location.address = data.get('address', location.address)
+                session.commit()
+                self.send_json(200, {'success': True, 'location': location.to_dict()})
+                print(f"✓ Saved location {location.name}")
+            except IntegrityError:
+                session.rollback()
+                self.send_json(409, {'success': False, 'message': f'A location named {name} already exists'})
+            except Exception as e:
+                session.rollback()
+                print(f"✗ Save location error: {e}")
+                self.send_json(500, {'success': False, 'message': str(e)})
+            finally:
+                session.close()
+            return
+        
+        # Set a tire's stock at one location (protected)
+        # {"tireId": 1, "locationId": 2, "quantity": 4}
+        if self.path == '/api/location-stock':
+            if not self.is_authenticated():
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            
+            try:
+                content_length = int(self.headers['Content-Length'])
+                data = json.loads(self.rfile.read(content_length))
+                tire_id = int(data['tireId'])
+                location_id = int(data['locationId'])
+                quantity = int(data.get('quantity', 0))
+                if quantity < 0:
+                    raise ValueError('quantity must not be negative')
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self.send_json(400, {'success': False, 'message': f'Valid tireId, locationId and quantity are required: {e}'})
+                return
+            
+            session = get_session()
+            try:
+                tire = session.query(Tire).filter_by(id=tire_id).first()
+                location = session.query(Location).filter_by(id=location_id).first()
+                if not tire or not location:
+                    self.send_json(404, {'success': False, 'message': 'Tire or location not found'})
+                    return
+                row, discarded = locations.set_location_quantity(session, tire, location.id, quantity)
+                session.commit()
+                cache.invalidate_inventory([tire.id])
+                self.send_json(200, {'success': True, 'stock': row.to_dict(), 'totalQuantity': tire.quantity,
+                                     'discarded': discarded})
+                print(f"✓ Tire {tire.id} at {location.name}: {quantity} (total {tire.quantity})")
+                if discarded:
+                    print(f"⚠ Tire {tire.id}: {discarded} untracked units dropped when stocking it per location")
+            except Exception as e:
+                session.rollback()
+                print(f"✗ Location stock error: {e}")
+                self.send_json(500, {'success': False, 'message': str(e)})
+            finally:
+                session.close()
+            return
+        
+        # Bulk price/stock change for every tire matching a filter (protected)
+        # {"filter": {"sizeLike": "R17"}, "operation": {"field": "price", "op": "add", "value": 5},
+        #  "preview": true}
+        if self.path == '/api/inventory/bulk':
+            if not self.is_authenticated():
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            
+            try:
+                content_length = int(self.headers['Content-Length'])
+                data = json.loads(self.rfile.read(content_length))
+                condition = bulk.parse_filter(data.get('filter'))
+                operation = bulk.Operation(data.get('operation'))
+            except (ValueError, TypeError, AttributeError) as e:
+                self.send_json(400, {'success': False, 'message': str(e)})
+                return
+            
+            session = get_session()
+            try:
+                if data.get('preview'):
+                    result = bulk.preview(session, condition, operation)
+                    self.send_json(200, dict(result, success=True, preview=True))
+                    return
+                updated = bulk.apply(session, condition, operation)
+                session.commit()
+                if updated:
+                    cache.invalidate_inventory()
+                self.send_json(200, {
+                    'success': True,
+                    'message': f'Updated {updated} item(s)',
+                    'updated': updated,
+                    'operation': operation.describe()
+                })
+                print(f"✓ Bulk {operation.field} {operation.op} {operation.value}: {updated} tires")
+            except Exception as e:
+                session.rollback()
+                print(f"✗ Bulk update error: {e}")
+                self.send_json(500, {'success': False, 'message': str(e)})
+            finally:
+                session.close()
+            return
+        
+        # Streaming CSV inventory import (protected)
+        # ?dry_run=1 runs the whole import, reports the counts and rolls back
+        if self.path.split('?', 1)[0] == '/api/import/inventory.csv':
+            if not self.is_authenticated():
+                self.close_connection = True
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            
+            content_length = int(self.headers['Content-Length'])
+            body = io.TextIOWrapper(
+                io.BufferedReader(streaming.BodyReader(self.rfile, content_length)),
+                encoding='utf-8-sig', newline=''
+            )
+            dry_run = parse_qs(urlparse(self.path).query).get('dry_run', [''])[0] in ('1', 'true')
+            session = get_session()
+            try:
+                inserted, updated, overwritten = streaming.import_inventory_csv(session, body)
+                if dry_run:
+                    session.rollback()
+                    message = f'{inserted} new item(s)'
+                    if updated:
+                        message += (f'; {updated} existing item(s) would have their '
+                                    f'{", ".join(overwritten) or "(no)"} overwritten')
+                    self.send_json(200, {
+                        'success': True,
+                        'dryRun': True,
+                        'message': message,
+                        'inserted': inserted,
+                        'updated': updated,
+                        'overwritten': overwritten
+                    })
+                    return
+                session.commit()
+                cache.invalidate_inventory()
+                self.send_json(200, {
+                    'success': True,
+                    'message': f'Imported {inserted + updated} items ({inserted} new, {updated} updated)',
+                    'inserted': inserted,
+                    'updated': updated
+                })
+                print(f"✓ Imported inventory CSV: {inserted} new, {updated} updated")
+            except (ValueError, UnicodeDecodeError) as e:
+                session.rollback()
+                self.close_connection = True
+                self.send_json(400, {'success': False, 'message': str(e)})
+            except Exception as e:
+                session.rollback()
+                print(f"✗ Inventory import error: {e}")
+                self.close_connection = True
+                self.send_json(500, {'success': False, 'message': str(e)})
+            finally:
+                session.close()
+            return
+        
         if self.path == '/api/save-inventory':
             # Check authentication for save operations
             if not self.is_authenticated():
@@ -479,6 +892,8 @@ class InventoryHandler(SimpleHTTPRequestHandler):
                 session = get_session()
                 
                 try:
+                    tracked = locations.tracked_tire_ids(session, [item['id'] for item in inventory_data])
+                    
                     # Update or create all tires
                     for item in inventory_data:
                         tire = session.query(Tire).filter_by(id=item['id']).first()
@@ -486,7 +901,8 @@ class InventoryHandler(SimpleHTTPRequestHandler):
                             # Update existing tire
                             tire.brand = item.get('brand', '')
                             tire.size = item.get('size', '')
-                            tire.quantity = item.get('quantity', 0)
+                            locations.set_total(session, tire, item.get('quantity', 0),
+                                                tracked=tire.id in tracked)
                             tire.price = item.get('price', 0.0)
                             tire.notes = item.get('notes', '')
                         else:
@@ -502,6 +918,7 @@ class InventoryHandler(SimpleHTTPRequestHandler):
                             session.add(tire)
                     
                     session.commit()
+                    cache.invalidate_inventory()
                     
                     # Success response
                     self.send_response(200)
@@ -538,15 +955,38 @@ class InventoryHandler(SimpleHTTPRequestHandler):
         self.wfile.write(response.encode())
     
     def do_GET(self):
-        # Handle inventory API
-        if self.path == '/data/inventory.json' or self.path == '/api/inventory':
+        if not self.admit_request():
+            return
+        try:
+            if self._admitted:
+                with profiler.track(self.command, self.path.split('?', 1)[0]):
+                    self.route_get()
+            else:
+                self.route_get()
+        finally:
+            self.release_request()
+    
+    def route_get(self):
+        parsed = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        
+        # Handle inventory API (?location=<id> lists stock held at one location)
+        if parsed.path == '/data/inventory.json' or parsed.path == '/api/inventory':
+            try:
+                location_id = int(params['location']) if params.get('location') else None
+            except ValueError:
+                self.send_json(400, {'success': False, 'message': 'location must be a number'})
+                return
             try:
                 # Create database session
                 session = get_session()
                 
                 try:
-                    tires = session.query(Tire).all()
-                    inventory_data = [tire.to_dict() for tire in tires]
+                    if location_id is not None:
+                        inventory_data = locations.location_inventory(session, location_id)
+                    else:
+                        tires = session.query(Tire).all()
+                        inventory_data = [tire.to_dict() for tire in tires]
                     
                     self.send_response(200)
                     self.send_header('Content-Type', 'application/json')
@@ -563,6 +1003,55 @@ class InventoryHandler(SimpleHTTPRequestHandler):
                 self.wfile.write(response.encode())
             return
         
+        # Facet counts and aggregates (public; stock value for admins only)
+        # /api/inventory/facets?size=&size_like=&brand=&min_qty=&in_stock=1
+        if parsed.path == '/api/inventory/facets':
+            try:
+                min_qty = int(params['min_qty']) if params.get('min_qty') else None
+            except ValueError:
+                self.send_json(400, {'success': False, 'message': 'min_qty must be a number'})
+                return
+            try:
+                result = inventory_engine.facets(
+                    size=params.get('size') or None,
+                    size_like=params.get('size_like') or None,
+                    brand=params.get('brand') or None,
+                    min_qty=min_qty,
+                    in_stock=params.get('in_stock') == '1',
+                    include_value=self.is_authenticated()
+                )
+                self.send_json(200, result)
+            except Exception as e:
+                print(f"✗ Facets error: {e}")
+                self.send_json(500, {'success': False, 'message': str(e)})
+            return
+        
+        # Locations (public)
+        if parsed.path == '/api/locations':
+            session = get_session()
+            try:
+                rows = session.query(Location).order_by(Location.name).all()
+                self.send_json(200, [location.to_dict() for location in rows])
+            except Exception as e:
+                self.send_json(500, {'success': False, 'message': str(e)})
+            finally:
+                session.close()
+            return
+        
+        # Per-location stock for one tire (public): /api/location-stock?tire=<id>
+        if parsed.path == '/api/location-stock':
+            if not params.get('tire', '').isdigit():
+                self.send_json(400, {'success': False, 'message': 'tire parameter required'})
+                return
+            session = get_session()
+            try:
+                self.send_json(200, locations.tire_locations(session, int(params['tire'])))
+            except Exception as e:
+                self.send_json(500, {'success': False, 'message': str(e)})
+            finally:
+                session.close()
+            return
+        
         # Handle orders API (protected)
         if self.path == '/api/orders':
             if not self.is_authenticated():
@@ -596,6 +1085,112 @@ class InventoryHandler(SimpleHTTPRequestHandler):
                 self.wfile.write(response.encode())
             return
         
+        # Streaming exports (protected)
+        if parsed.path in ('/api/export/inventory.csv', '/api/export/orders.ndjson'):
+            if not self.is_authenticated():
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            
+            session = get_session()
+            out = None
+            try:
+                if parsed.path == '/api/export/inventory.csv':
+                    out = self.start_stream('text/csv; charset=utf-8', 'inventory.csv')
+                    count = streaming.export_inventory_csv(session, out)
+                else:
+                    include_archive = params.get('archive') == '1'
+                    out = self.start_stream('application/x-ndjson', 'orders.ndjson')
+                    count = streaming.export_orders_ndjson(session, out, include_archive)
+                out.close()
+                print(f"✓ Exported {count} rows to {parsed.path}")
+            except Exception as e:
+                print(f"✗ Export error on {parsed.path}: {e}")
+                if out is None:
+                    self.send_json(500, {'success': False, 'message': str(e)})
+                # Otherwise headers are already sent; dropping the connection
+                # without the final chunk marks the export incomplete
+                self.close_connection = True
+            finally:
+                session.close()
+            return
+        
+        # Order history search across hot and archived orders (protected)
+        # /api/orders/search?q=&status=&from=&to=&limit=&archive=0
+        # /api/orders/<id>
+        if parsed.path.startswith('/api/orders/'):
+            if not self.is_authenticated():
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            
+            session = get_session()
+            try:
+                if parsed.path == '/api/orders/search':
+                    try:
+                        start = datetime.fromisoformat(params['from']) if params.get('from') else None
+                        end = datetime.fromisoformat(params['to']) if params.get('to') else None
+                        limit = max(1, min(1000, int(params.get('limit', 200))))
+                    except ValueError as e:
+                        self.send_json(400, {'success': False, 'message': str(e)})
+                        return
+                    orders_data = archive.search_orders(
+                        session,
+                        q=params.get('q', '').strip() or None,
+                        status=params.get('status') or None,
+                        start=start,
+                        end=end,
+                        limit=limit,
+                        include_archive=params.get('archive', '1') != '0'
+                    )
+                    self.send_json(200, orders_data)
+                    return
+                
+                order_id = parsed.path[len('/api/orders/'):]
+                order_data = archive.find_order(session, int(order_id)) if order_id.isdigit() else None
+                if order_data is None:
+                    self.send_json(404, {'success': False, 'message': 'Order not found'})
+                else:
+                    self.send_json(200, order_data)
+            except Exception as e:
+                self.send_json(500, {'success': False, 'message': str(e)})
+            finally:
+                session.close()
+            return
+        
+        # Profiling captures (protected)
+        # /api/profiling, /api/profiling/<id> (JSON), /api/profiling/<id>.pstats
+        if parsed.path == '/api/profiling' or parsed.path.startswith('/api/profiling/'):
+            if not self.is_authenticated():
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            if parsed.path == '/api/profiling':
+                self.send_json(200, {'settings': profiler.settings(), 'captures': profiler.list_captures()})
+                return
+            
+            name = parsed.path[len('/api/profiling/'):]
+            as_pstats = name.endswith('.pstats')
+            capture_id = name[:-len('.pstats')] if as_pstats else name
+            capture = profiler.get_capture(int(capture_id)) if capture_id.isdigit() else None
+            if capture is None or (as_pstats and capture['pstats'] is None):
+                self.send_json(404, {'success': False, 'message': 'Capture not found'})
+            elif as_pstats:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Disposition', f'attachment; filename="request-{capture_id}.pstats"')
+                self.send_header('Content-Length', str(len(capture['pstats'])))
+                self.end_headers()
+                self.wfile.write(capture['pstats'])
+            else:
+                self.send_json(200, profiling.capture_json(capture))
+            return
+        
+        # Admission control counters (protected)
+        if self.path == '/api/admission-stats':
+            if not self.is_authenticated():
+                self.send_json(401, {'success': False, 'message': 'Unauthorized'})
+                return
+            self.send_json(200, admission.snapshot())
+            return
+        
         # Redirect root to web interface
         if self.path == '/' or self.path == '':
             self.send_response(302)
@@ -624,6 +1219,9 @@ class InventoryHandler(SimpleHTTPRequestHandler):
 def run(port=8000):
     server_address = ('0.0.0.0', port)
     httpd = ThreadingHTTPServer(server_address, InventoryHandler)
+    idempotency.start_purger(IDEMPOTENCY_PURGE_INTERVAL)
+    if ARCHIVE_AFTER_DAYS > 0:
+        archive.start_archiver(ARCHIVE_INTERVAL, ARCHIVE_AFTER_DAYS)
     print(f'Server running on port {port} (multi-threaded)', flush=True)
     print(f'Working directory: {os.getcwd()}', flush=True)
     httpd.serve_forever()
@@ -0,0 +1,219 @@
+"""
+Streaming CSV/NDJSON export and import.
+Rows are read from the database in batches with server-side cursors and
+written out as they are produced; uploads are parsed line by line, so memory
+use doesn't depend on the size of the dataset.
+"""
+
+import csv
+import io
+import json
+import re
+
+from sqlalchemy import select
+
+from models import Tire, Order, ArchivedOrder
+import locations
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+# Values for new tires whose CSV cell is missing or blank (quantity 1 as the
+# old client-side import did). Existing tires keep theirs.
+NEW_TIRE_DEFAULTS = {'brand': '', 'quantity': 1, 'price': 0.0, 'notes': ''}
+
+INVENTORY_COLUMNS = ['id', 'size', 'brand', 'quantity', 'price', 'notes']
+
+
+class ChunkedWriter:
+    """File-like writer that buffers output and sends it as HTTP chunks
+    (or as a plain stream when `chunked` is False)"""
+
+    def __init__(self, wfile, chunked=True, chunk_size=CHUNK_SIZE):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+        self.buffer = io.StringIO()
+        self.size = 0
+
+    def write(self, text):
+        self.buffer.write(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        data = self.buffer.getvalue().encode()
+        self.buffer = io.StringIO()
+        self.size = 0
+        if not data:
+            return
+        if self.chunked:
+            self.wfile.write(f'{len(data):X}\r\n'.encode() + data + b'\r\n')
+        else:
+            self.wfile.write(data)
+
+    def close(self):
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+class BodyReader(io.RawIOBase):
+    """Reads at most `length` bytes from a socket file so the request body
+    can be consumed incrementally without running into the next request"""
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        if self.remaining <= 0:
+            return 0
+        data = self.rfile.read(min(len(buf), self.remaining))
+        self.remaining -= len(data)
+        buf[:len(data)] = data
+        return len(data)
+
+
+def export_inventory_csv(session, out):
+    """Write every tire as CSV"""
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(INVENTORY_COLUMNS)
+    stmt = select(Tire.id, Tire.size, Tire.brand, Tire.quantity, Tire.price, Tire.notes) \
+        .order_by(Tire.id).execution_options(yield_per=BATCH_SIZE)
+    count = 0
+    for row in session.execute(stmt):
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def export_orders_ndjson(session, out, include_archive=False):
+    """Write orders as one JSON object per line, oldest first"""
+    count = 0
+    for order in session.query(Order).order_by(Order.id).yield_per(BATCH_SIZE):
+        out.write(json.dumps(order.to_dict()) + '\n')
+        count += 1
+    if include_archive:
+        for archived in session.query(ArchivedOrder).order_by(ArchivedOrder.id).yield_per(BATCH_SIZE):
+            out.write(json.dumps(archived.to_dict()) + '\n')
+            count += 1
+    return count
+
+
+def simplify(header):
+    return re.sub(r'[^a-z0-9]+', '', str(header or '').lower())
+
+
+def map_header(key):
+    """Map the header spellings accepted by the admin CSV import to Tire fields
+    (mirrors mapHeader in web/admin.js; model/tread aren't stored)"""
+    if key in ('id', 'size', 'brand', 'notes'):
+        return key
+    if key in ('quantity', 'qty', 'count'):
+        return 'quantity'
+    if key in ('price', 'cost'):
+        return 'price'
+    if key in ('note', 'comment'):
+        return 'notes'
+    return None
+
+
+def _to_number(value, cast, default):
+    value = (value or '').strip()
+    if not value:
+        return default
+    return cast(float(value)) if cast is int else cast(value)
+
+
+def _to_text(value):
+    value = (value or '').strip()
+    return value or None
+
+
+def parse_inventory_row(row, columns):
+    """Turn a CSV row into Tire field values. A column that is missing or
+    blank comes back as None. Raises ValueError on bad numbers"""
+    item = {}
+    for value, field in zip(row, columns):
+        if field:
+            item[field] = value
+    return {
+        'id': _to_number(item.get('id'), int, None),
+        'size': _to_text(item.get('size')),
+        'brand': _to_text(item.get('brand')),
+        'quantity': _to_number(item.get('quantity'), int, None),
+        'price': _to_number(item.get('price'), float, None),
+        'notes': _to_text(item.get('notes')),
+    }
+
+
+def import_inventory_csv(session, stream):
+    """Upsert tires from a CSV text stream, matched by id (rows without an id
+    are added). A missing or blank cell leaves an existing tire's value alone;
+    new tires get NEW_TIRE_DEFAULTS for it (size is required). Works in
+    batches of BATCH_SIZE rows and releases each batch from the session
+    after flushing. The caller commits.
+    Returns (inserted, updated, overwritten) where `overwritten` lists the
+    fields changed on existing tires."""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if not header:
+        return 0, 0, []
+    columns = [map_header(simplify(h)) for h in header]
+    if 'size' not in columns and 'id' not in columns:
+        raise ValueError('CSV must have a size or id column')
+
+    inserted = updated = 0
+    overwritten = set()
+    batch = []
+
+    def apply(batch):
+        nonlocal inserted, updated
+        ids = [item['id'] for _, item in batch if item['id'] is not None]
+        existing = {}
+        if ids:
+            existing = {t.id: t for t in session.query(Tire).filter(Tire.id.in_(ids))}
+        tracked = locations.tracked_tire_ids(session, list(existing))
+        for line_no, item in batch:
+            tire = existing.get(item['id'])
+            if tire:
+                for field in ('size', 'brand', 'price', 'notes'):
+                    if item[field] is not None:
+                        setattr(tire, field, item[field])
+                        overwritten.add(field)
+                if item['quantity'] is not None:
+                    locations.set_total(session, tire, item['quantity'], tracked=tire.id in tracked)
+                    overwritten.add('quantity')
+                updated += 1
+            else:
+                if item['size'] is None:
+                    raise ValueError(f'Line {line_no}: size is required for a new tire')
+                values = {k: v for k, v in item.items() if v is not None}
+                tire = Tire(**dict(NEW_TIRE_DEFAULTS, **values))
+                session.add(tire)
+                if item['id'] is not None:
+                    existing[item['id']] = tire
+                inserted += 1
+        session.flush()
+        session.expunge_all()
+
+    for line_no, row in enumerate(reader, start=2):
+        if not any(v.strip() for v in row):
+            continue
+        try:
+            item = parse_inventory_row(row, columns)
+        except ValueError as e:
+            raise ValueError(f'Line {line_no}: {e}')
+        batch.append((line_no, item))
+        if len(batch) >= BATCH_SIZE:
+            apply(batch)
+            batch = []
+    if batch:
+        apply(batch)
+
+    return inserted, updated, sorted(overwritten)
@@ -1,5 +1,6 @@
 const state = {
   items: [],
+  bulk: null,
 };
 
 const els = {
@@ -22,6 +23,17 @@ const els = {
   fQty: document.getElementById("fQty"),
   fPrice: document.getElementById("fPrice"),
   fNotes: document.getElementById("fNotes"),
+  bulkForm: document.getElementById("bulkForm"),
+  bSizeLike: document.getElementById("bSizeLike"),
+  bBrand: document.getElementById("bBrand"),
+  bMinQty: document.getElementById("bMinQty"),
+  bMaxQty: document.getElementById("bMaxQty"),
+  bMinPrice: document.getElementById("bMinPrice"),
+  bMaxPrice: document.getElementById("bMaxPrice"),
+  bOperation: document.getElementById("bOperation"),
+  bValue: document.getElementById("bValue"),
+  bulkApplyBtn: document.getElementById("bulkApplyBtn"),
+  bulkResult: document.getElementById("bulkResult"),
 };
 
 async function init() {
@@ -79,6 +91,66 @@ async function saveToServer() {
   }
 }
 
+function bulkRequest() {
+  const [field, op] = els.bOperation.value.split(":");
+  const filter = {
+    sizeLike: els.bSizeLike.value.trim(),
+    brand: els.bBrand.value.trim(),
+    minQty: els.bMinQty.value,
+    maxQty: els.bMaxQty.value,
+    minPrice: els.bMinPrice.value,
+    maxPrice: els.bMaxPrice.value,
+  };
+  if (!Object.values(filter).some((v) => v !== "")) filter.all = true;
+  return { filter, operation: { field, op, value: els.bValue.value } };
+}
+
+async function postBulk(body) {
+  const response = await fetch("/api/inventory/bulk", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body),
+  });
+  const result = await response.json();
+  if (!result.success) throw new Error(result.message);
+  return result;
+}
+
+// Ask the server which rows a bulk change would touch; Apply sends the same request
+async function previewBulk() {
+  els.bulkApplyBtn.disabled = true;
+  state.bulk = null;
+  try {
+    const request = bulkRequest();
+    const result = await postBulk({ ...request, preview: true });
+    const lines = result.sample.map((r) => `#${r.id} ${r.size} ${r.brand}: ${r.old} → ${r.new}`);
+    let text = `${result.changed} of ${result.matched} matching item(s) would change`;
+    if (result.tracked) text += ` (${result.tracked} stocked per location)`;
+    if (result.changed > result.sample.length) lines.push("…");
+    els.bulkResult.innerText = [text, ...lines].join("\n");
+    if (result.changed > 0) {
+      state.bulk = { request, changed: result.changed };
+      els.bulkApplyBtn.disabled = false;
+    }
+  } catch (err) {
+    els.bulkResult.textContent = "Preview failed: " + err.message;
+  }
+}
+
+async function applyBulk() {
+  if (!state.bulk) return;
+  if (!confirm(`Change ${state.bulk.changed} item(s)?`)) return;
+  els.bulkApplyBtn.disabled = true;
+  try {
+    const result = await postBulk(state.bulk.request);
+    els.bulkResult.textContent = result.message;
+    state.bulk = null;
+    await init();
+  } catch (err) {
+    els.bulkResult.textContent = "Bulk change failed: " + err.message;
+  }
+}
+
 function render() {
   els.countMeta.textContent = `${state.items.length} item(s)`;
   const frag = document.createDocumentFragment();
@@ -186,45 +258,40 @@ function onTableClick(e) {
 //   reader.readAsText(file);
 // }
 
-function onImportCsv(e) {
+async function onImportCsv(e) {
   const file = e.target.files?.[0];
   if (!file) return;
-  const reader = new FileReader();
-  reader.onload = () => {
-    try {
-      const text = String(reader.result || "");
-      const objs = parseCSV(text);
-      if (!objs.length) {
-        alert("No rows found in CSV.");
-        return;
-      }
-      
-      // Get the highest existing ID
-      const maxId = state.items.reduce((max, item) => Math.max(max, Number(item.id) || 0), 0);
-      
-      // Normalize new items with sequential IDs starting after maxId
-      const newItems = objs.map((item, index) => ({
-        id: maxId + index + 1,
-        size: String(item.size || "").trim(),
-        brand: item.brand || "",
-        model: item.model || "",
-        tread_32nds: Number(item.tread_32nds ?? 0) || 0,
-        quantity: Number(item.quantity ?? 1) || 1,
-        price: Number(item.price ?? 0) || 0,
-        notes: item.notes || "",
-      }));
-      
-      // Add new items to existing inventory
-      state.items = [...state.items, ...newItems];
-      render();
-      
-      alert(`Added ${newItems.length} item(s) to inventory. Click "Save to Server" to persist changes.`);
-    } catch (err) {
-      console.error(err);
-      alert("Failed to import CSV: " + err.message);
-    }
+  const upload = async (url) => {
+    const response = await fetch(url, {
+      method: 'POST',
+      headers: { 'Content-Type': 'text/csv' },
+      body: file,
+    });
+    const result = await response.json();
+    if (!result.success) throw new Error(result.message);
+    return result;
   };
-  reader.readAsText(file);
+  try {
+    // The server parses the upload as it arrives and upserts rows by id.
+    // Unlike the editor, the import is saved straight away, so check first
+    const preview = await upload('/api/import/inventory.csv?dry_run=1');
+    let question = `Import ${preview.inserted + preview.updated} row(s) into the server inventory now?\n\n` +
+                   `${preview.inserted} new item(s)`;
+    if (preview.updated) {
+      const fields = preview.overwritten.length ? preview.overwritten.join(", ") : "nothing";
+      question += `\n${preview.updated} existing item(s) with the same id: ${fields} will be OVERWRITTEN`;
+    }
+    question += "\n\nBlank cells leave existing items unchanged; new items get quantity 1.";
+    if (!confirm(question)) return;
+    const result = await upload('/api/import/inventory.csv');
+    alert(result.message);
+    await init();
+  } catch (err) {
+    console.error(err);
+    alert("Failed to import CSV: " + err.message);
+  } finally {
+    e.target.value = "";
+  }
 }
 
 // function exportJSON() {
@@ -257,34 +324,13 @@ function clearAll() {
 }
 
 function exportCSV() {
-  const headers = ["id","size","brand","model","tread_32nds","quantity","price","notes"];
-  const escape = (v) => {
-    const s = String(v ?? "");
-    if (/[",\n\r]/.test(s)) return '"' + s.replaceAll('"', '""') + '"';
-    return s;
-  };
-  const rows = [headers.join(",")];
-  for (const it of state.items) {
-    rows.push([
-      it.id,
-      it.size,
-      it.brand,
-      it.model,
-      it.tread_32nds,
-      it.quantity,
-      it.price,
-      it.notes,
-    ].map(escape).join(","));
-  }
-  const blob = new Blob([rows.join("\n")], { type: "text/csv" });
-  const url = URL.createObjectURL(blob);
+  // Streamed from the database by the server
   const a = document.createElement("a");
-  a.href = url;
+  a.href = "/api/export/inventory.csv";
   a.download = "inventory.csv";
   document.body.appendChild(a);
   a.click();
   a.remove();
-  URL.revokeObjectURL(url);
 }
 
 function downloadCsvTemplate() {
@@ -301,74 +347,6 @@ function downloadCsvTemplate() {
   URL.revokeObjectURL(url);
 }
 
-function parseCSV(text) {
-  const rows = [];
-  let cur = [];
-  let field = '';
-  let i = 0;
-  let inQuotes = false;
-  const pushField = () => { cur.push(field); field = ''; };
-  const pushRow = () => { rows.push(cur); cur = []; };
-  while (i < text.length) {
-    const c = text[i];
-    if (inQuotes) {
-      if (c === '"') {
-        if (text[i + 1] === '"') { field += '"'; i += 2; continue; }
-        inQuotes = false; i++; continue;
-      } else { field += c; i++; continue; }
-    } else {
-      if (c === '"') { inQuotes = true; i++; continue; }
-      if (c === ',') { pushField(); i++; continue; }
-      if (c === '\n') { pushField(); pushRow(); i++; continue; }
-      if (c === '\r') { // handle CRLF or lone CR
-        if (text[i + 1] === '\n') { pushField(); pushRow(); i += 2; continue; }
-        pushField(); pushRow(); i++; continue;
-      }
-      field += c; i++; continue;
-    }
-  }
-  // flush last field/row if any content
-  if (inQuotes) {
-    // Unbalanced quotes; best-effort finalize
-    inQuotes = false;
-  }
-  if (field.length > 0 || cur.length > 0) { pushField(); pushRow(); }
-  if (!rows.length) return [];
-  const headers = rows[0].map(h => simplify(h));
-  const objs = [];
-  for (let r = 1; r < rows.length; r++) {
-    const row = rows[r];
-    if (row.every(v => String(v).trim() === '')) continue; // skip empty rows
-    const o = {};
-    for (let cidx = 0; cidx < headers.length; cidx++) {
-      const key = headers[cidx];
-      const val = row[cidx] ?? '';
-      const mapped = mapHeader(key);
-      if (!mapped) continue;
-      o[mapped] = val;
-    }
-    objs.push(o);
-  }
-  return objs;
-}
-
-function simplify(h) {
-  return String(h || '').toLowerCase().replace(/[^a-z0-9]+/g, '');
-}
-
-function mapHeader(k) {
-  // Map various header spellings to our schema
-  if (k === 'id') return 'id';
-  if (k === 'size') return 'size';
-  if (k === 'brand') return 'brand';
-  if (k === 'model') return 'model';
-  if (k === 'tread' || k === 'tread32nds' || k === '32nds' || k === 'treaddepth') return 'tread_32nds';
-  if (k === 'quantity' || k === 'qty' || k === 'count') return 'quantity';
-  if (k === 'price' || k === 'cost') return 'price';
-  if (k === 'notes' || k === 'note' || k === 'comment') return 'notes';
-  return null;
-}
-
 // Logout function
 async function logout() {
   try {
@@ -382,6 +360,9 @@ async function logout() {
 
 // Wire UI
 els.addForm.addEventListener("submit", (e) => { e.preventDefault(); upsertFromForm(); });
+els.bulkForm.addEventListener("submit", (e) => { e.preventDefault(); previewBulk(); });
+els.bulkForm.addEventListener("input", () => { els.bulkApplyBtn.disabled = true; state.bulk = null; });
+els.bulkApplyBtn.addEventListener("click", applyBulk);
 els.tableBody.addEventListener("input", onTableInput);
 els.tableBody.addEventListener("change", onTableInput);
 els.tableBody.addEventListener("click", onTableClick);
@@ -2,8 +2,11 @@ const state = {
   all: [],
   filtered: [],
   sizes: new Map(),
+  facets: null, // server-side size counts: { sizes: Map(size -> quantity), total }
   cart: {},
+  cartLocations: {}, // { id: location_id } for tires picked while filtered to a location
   filters: {
+    location: "",
     size: "",
     minTread: 0,
     q: "",
@@ -13,6 +16,8 @@ const state = {
 
 const els = {
   sizeFilter: document.getElementById("sizeFilter"),
+  locationFilter: document.getElementById("locationFilter"),
+  locationLabel: document.getElementById("locationLabel"),
   minTread: document.getElementById("minTread"),
   search: document.getElementById("search"),
   sortBy: document.getElementById("sortBy"),
@@ -26,7 +31,9 @@ const els = {
 
 async function loadInventory() {
   try {
-    const candidates = ["../data/inventory.json", "/data/inventory.json", "data/inventory.json"];
+    const candidates = state.filters.location
+      ? [`/api/inventory?location=${encodeURIComponent(state.filters.location)}`]
+      : ["../data/inventory.json", "/data/inventory.json", "data/inventory.json"];
     let data = null;
     let lastErr = null;
     for (const url of candidates) {
@@ -40,7 +47,8 @@ async function loadInventory() {
     state.all = normalize(data);
     loadCartFromStorage();
     console.log("Loaded items:", state.all.length);
-    buildSizeIndex();
+    state.facets = await loadFacets();
+    if (!state.facets) buildSizeIndex();
     populateSizeControls();
     applyFilters();
   } catch (err) {
@@ -56,12 +64,48 @@ function normalize(items) {
     brand: t.brand || "",
     model: t.model || "",
     tread_32nds: Number(t.tread_32nds ?? 0),
-    quantity: Number(t.quantity ?? 1),
+    // At a single location, show what that yard holds
+    quantity: Number(t.location_quantity ?? t.quantity ?? 1),
     price: Number(t.price ?? 0),
     notes: t.notes || "",
+    location_id: t.location_id ?? null,
   }));
 }
 
+// Location picker only appears once the shop has set up locations
+async function loadLocations() {
+  try {
+    const resp = await fetch("/api/locations", { cache: "no-store" });
+    if (!resp.ok) return;
+    const locations = await resp.json();
+    if (!locations.length) return;
+    for (const loc of locations) {
+      const opt = document.createElement("option");
+      opt.value = String(loc.id);
+      opt.textContent = loc.name;
+      els.locationFilter.appendChild(opt);
+    }
+    els.locationLabel.style.display = "";
+  } catch {}
+}
+
+// Per-size quantities from the server's inventory engine; null when unavailable
+// (static hosting) or when browsing one location
+async function loadFacets() {
+  if (state.filters.location) return null;
+  try {
+    const resp = await fetch("/api/inventory/facets", { cache: "no-store" });
+    if (!resp.ok) return null;
+    const data = await resp.json();
+    return {
+      sizes: new Map(data.sizes.map((f) => [String(f.size).trim() || "Unknown", f.quantity])),
+      total: data.totals.quantity,
+    };
+  } catch {
+    return null;
+  }
+}
+
 function buildSizeIndex() {
   state.sizes = new Map();
   for (const item of state.all) {
@@ -90,6 +134,7 @@ function getSelectedItems() {
 }
 
 const CART_KEY = 'tire_cart';
+const CART_LOCATIONS_KEY = 'tire_cart_locations';
 function loadCartFromStorage() {
   try {
     const raw = localStorage.getItem(CART_KEY);
@@ -98,20 +143,27 @@ function loadCartFromStorage() {
     if (parsed && typeof parsed === 'object') {
       state.cart = parsed;
     }
+    state.cartLocations = JSON.parse(localStorage.getItem(CART_LOCATIONS_KEY) || '{}') || {};
   } catch {}
 }
 function saveCartToStorage() {
-  try { localStorage.setItem(CART_KEY, JSON.stringify(state.cart)); } catch {}
+  try {
+    localStorage.setItem(CART_KEY, JSON.stringify(state.cart));
+    localStorage.setItem(CART_LOCATIONS_KEY, JSON.stringify(state.cartLocations));
+  } catch {}
 }
 
 function populateSizeControls() {
-  const entries = [...state.sizes.entries()].sort((a, b) => a[0].localeCompare(b[0], undefined, { numeric: true }));
-  const total = sumQuantities(state.all);
+  const counts = state.facets
+    ? [...state.facets.sizes.entries()]
+    : [...state.sizes.entries()].map(([size, arr]) => [size, sumQuantities(arr)]);
+  const entries = counts.sort((a, b) => a[0].localeCompare(b[0], undefined, { numeric: true }));
+  const total = state.facets ? state.facets.total : sumQuantities(state.all);
   const listHtml = [
     `<h2>Sizes</h2>`,
     `<ul class="size-list">`,
     `<li class="size-item"><a href="#" data-size=""><span>All sizes</span> <span class="count">${total}</span></a></li>`,
-    ...entries.map(([size, arr]) => `<li class="size-item"><a href="#" data-size="${size}"><span>${size}</span> <span class="count">${sumQuantities(arr)}</span></a></li>`),
+    ...entries.map(([size, qty]) => `<li class="size-item"><a href="#" data-size="${size}"><span>${size}</span> <span class="count">${qty}</span></a></li>`),
     `</ul>`
   ].join('');
   els.sizeList.innerHTML = listHtml;
@@ -226,6 +278,9 @@ function onGridInput(e) {
   qty = Math.max(0, Math.min(max, Math.floor(qty)));
   input.value = String(qty);
   if (qty > 0) state.cart[id] = qty; else delete state.cart[id];
+  // Fill the order from the location the shopper was looking at
+  if (qty > 0 && item.location_id != null) state.cartLocations[id] = item.location_id;
+  else delete state.cartLocations[id];
   saveCartToStorage();
   const listings = state.filtered.length;
   const totalTires = sumQuantities(state.filtered);
@@ -246,6 +301,7 @@ function onGridInput(e) {
 }
 
 function wireControls() {
+  els.locationFilter.addEventListener("change", (e) => { state.filters.location = e.target.value; loadInventory(); });
   els.sizeFilter.addEventListener("change", (e) => { state.filters.size = e.target.value; applyFilters(); });
   els.minTread.addEventListener("input", (e) => { state.filters.minTread = e.target.value; applyFilters(); });
   els.search.addEventListener("input", (e) => { state.filters.q = e.target.value; applyFilters(); });
@@ -280,5 +336,6 @@ function updateCartLinkCount() {
   els.viewCartBtn.textContent = tires > 0 ? `View Cart (${tires})` : 'View Cart';
 }
 wireControls();
+loadLocations();
 loadInventory();
 
@@ -11,11 +11,19 @@ const state = {
   cart: {}, // { id: qty }
 };
 
+const CART_LOCATIONS_KEY = 'tire_cart_locations'; // { id: location_id }, set by the catalog
+
 function loadCartFromStorage() {
   try { const raw = localStorage.getItem(CART_KEY); if (raw) state.cart = JSON.parse(raw) || {}; } catch {}
 }
 function saveCartToStorage() {
-  try { localStorage.setItem(CART_KEY, JSON.stringify(state.cart)); } catch {}
+  try {
+    localStorage.setItem(CART_KEY, JSON.stringify(state.cart));
+    // Drop the location choice for tires no longer in the cart
+    const locations = JSON.parse(localStorage.getItem(CART_LOCATIONS_KEY) || '{}') || {};
+    for (const id of Object.keys(locations)) if (!(id in state.cart)) delete locations[id];
+    localStorage.setItem(CART_LOCATIONS_KEY, JSON.stringify(locations));
+  } catch {}
 }
 
 async function loadInventory() {
@@ -26,6 +34,29 @@ async function loadInventory() {
   state.all = [];
 }
 
+// Re-price the cart on the server so stale localStorage/catalog prices aren't shown
+async function refreshQuote() {
+  const items = Object.entries(state.cart).map(([id, qty]) => ({ id: Number(id), qty: Number(qty) || 0 }));
+  if (!items.length) return;
+  try {
+    const r = await fetch('/api/cart/quote', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ items }),
+    });
+    if (r.ok) applyQuote(await r.json());
+  } catch {}
+}
+
+function applyQuote(quote) {
+  for (const line of quote.items || []) {
+    const it = state.all.find(x => Number(x.id) === line.id);
+    if (!it) continue;
+    it.price = line.price;
+    it.quantity = line.available;
+  }
+}
+
 function getSelectedItems() {
   const items = [];
   for (const [idStr, qty] of Object.entries(state.cart)) {
@@ -39,9 +70,14 @@ function getSelectedItems() {
   return items;
 }
 
+// Each line is rounded to cents before summing, as the server prices orders
+function lineCost(it) {
+  return Math.round(it.selected_qty * (Number(it.price)||0) * 100) / 100;
+}
+
 function selectedTotals(items) {
   return items.reduce((acc, it) => {
-    acc.tires += it.selected_qty; acc.cost += it.selected_qty * (Number(it.price)||0); return acc;
+    acc.tires += it.selected_qty; acc.cost += lineCost(it); return acc;
   }, { tires: 0, cost: 0 });
 }
 
@@ -53,7 +89,7 @@ function render() {
   for (const it of items) {
     const tr = document.createElement('tr');
     tr.dataset.id = String(it.id);
-    const line = (Number(it.price)||0) * it.selected_qty;
+    const line = lineCost(it);
     tr.innerHTML = `
       <td>
         <div class="qty-controls">
@@ -122,7 +158,7 @@ function printCart() {
   const items = getSelectedItems();
   const { cost } = selectedTotals(items);
   const w = window.open('', '_blank'); if (!w) return;
-  const rows = items.map(it => `<tr><td>${it.selected_qty}</td><td>${escapeHtml(it.size)}</td><td>${escapeHtml(`${it.brand} ${it.model}`.trim())}</td><td>$${(Number(it.price)||0).toFixed(2)}</td><td>$${(it.selected_qty*(Number(it.price)||0)).toFixed(2)}</td></tr>`).join('');
+  const rows = items.map(it => `<tr><td>${it.selected_qty}</td><td>${escapeHtml(it.size)}</td><td>${escapeHtml(`${it.brand} ${it.model}`.trim())}</td><td>$${(Number(it.price)||0).toFixed(2)}</td><td>$${lineCost(it).toFixed(2)}</td></tr>`).join('');
   w.document.write(`<!DOCTYPE html><html><head><meta charset="utf-8"><title>Cart</title><style>
     body{font-family:system-ui,Segoe UI,Roboto,Helvetica,Arial;margin:20px;color:#111}
     h1{font-size:18px;margin:0 0 10px}
@@ -150,6 +186,7 @@ function wire() {
 (async function init(){
   loadCartFromStorage();
   await loadInventory();
+  await refreshQuote();
   wire();
   render();
 })();
@@ -1,11 +1,18 @@
 const CART_KEY = 'tire_cart';
+const CART_LOCATIONS_KEY = 'tire_cart_locations';
 
 const state = {
   all: [],
   cart: {},
+  cartLocations: {}, // { id: location_id } chosen in the catalog
   orderItems: [],
+  // Idempotency key for the order being placed; reused on retries so the server
+  // never creates the same order twice
+  pendingOrder: null, // { key, signature }
 };
 
+const SUBMIT_ATTEMPTS = 4;
+
 const els = {
   orderSummary: document.getElementById('orderSummary'),
   checkoutForm: document.getElementById('checkoutForm'),
@@ -17,6 +24,7 @@ function loadCartFromStorage() {
   try {
     const raw = localStorage.getItem(CART_KEY);
     if (raw) state.cart = JSON.parse(raw) || {};
+    state.cartLocations = JSON.parse(localStorage.getItem(CART_LOCATIONS_KEY) || '{}') || {};
   } catch {}
 }
 
@@ -34,6 +42,29 @@ async function loadInventory() {
   state.all = [];
 }
 
+// Re-price the cart on the server so stale localStorage/catalog prices aren't shown
+async function refreshQuote() {
+  const items = Object.entries(state.cart).map(([id, qty]) => ({ id: Number(id), qty: Number(qty) || 0 }));
+  if (!items.length) return;
+  try {
+    const r = await fetch('/api/cart/quote', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ items }),
+    });
+    if (r.ok) applyQuote(await r.json());
+  } catch {}
+}
+
+function applyQuote(quote) {
+  for (const line of quote.items || []) {
+    const it = state.all.find(x => Number(x.id) === line.id);
+    if (!it) continue;
+    it.price = line.price;
+    it.quantity = line.available;
+  }
+}
+
 function getSelectedItems() {
   const items = [];
   for (const [idStr, qty] of Object.entries(state.cart)) {
@@ -42,15 +73,22 @@ function getSelectedItems() {
     if (!it) continue;
     const q = Math.max(0, Math.min(Number(qty)||0, Number(it.quantity)||0));
     if (q <= 0) continue;
-    items.push({ ...it, selected_qty: q });
+    const item = { ...it, selected_qty: q };
+    if (state.cartLocations[idStr] != null) item.location_id = state.cartLocations[idStr];
+    items.push(item);
   }
   return items;
 }
 
+// Each line is rounded to cents before summing, as the server prices orders
+function lineCost(it) {
+  return Math.round(it.selected_qty * (Number(it.price)||0) * 100) / 100;
+}
+
 function selectedTotals(items) {
   return items.reduce((acc, it) => {
     acc.tires += it.selected_qty;
-    acc.cost += it.selected_qty * (Number(it.price)||0);
+    acc.cost += lineCost(it);
     return acc;
   }, { tires: 0, cost: 0 });
 }
@@ -71,7 +109,7 @@ function renderOrderSummary() {
   const { tires, cost } = selectedTotals(state.orderItems);
   
   const rows = state.orderItems.map(it => {
-    const lineTotal = it.selected_qty * (Number(it.price)||0);
+    const lineTotal = lineCost(it);
     return `
       <tr>
         <td>${it.selected_qty}</td>
@@ -119,6 +157,52 @@ function toggleAddressFields() {
   }
 }
 
+function newIdempotencyKey() {
+  if (window.crypto && typeof crypto.randomUUID === 'function') return crypto.randomUUID();
+  const bytes = new Uint8Array(16);
+  crypto.getRandomValues(bytes);
+  return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// Same key for the same order contents, a new one if the customer changes anything
+function idempotencyKeyFor(orderData) {
+  const { id, timestamp, status, ...rest } = orderData;
+  const signature = JSON.stringify(rest);
+  if (!state.pendingOrder || state.pendingOrder.signature !== signature) {
+    state.pendingOrder = { key: newIdempotencyKey(), signature };
+  }
+  return state.pendingOrder.key;
+}
+
+// POST the order, retrying network failures and 5xx/429 with the same key
+async function postOrder(orderData, key) {
+  const body = JSON.stringify(orderData);
+  let lastError;
+  for (let attempt = 0; attempt < SUBMIT_ATTEMPTS; attempt++) {
+    if (attempt > 0) {
+      await new Promise(r => setTimeout(r, Math.min(8000, 500 * 2 ** attempt)));
+    }
+    try {
+      const response = await fetch('/api/submit-order', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': key,
+        },
+        body,
+      });
+      if (response.status >= 500 || response.status === 429) {
+        lastError = new Error(`Server responded ${response.status}`);
+        continue;
+      }
+      return await response.json();
+    } catch (err) {
+      lastError = err;
+    }
+  }
+  throw lastError;
+}
+
 async function handleSubmit(e) {
   e.preventDefault();
   
@@ -160,22 +244,27 @@ async function handleSubmit(e) {
     submitBtn.textContent = 'Placing Order...';
     
     // Submit order to server
-    const response = await fetch('/api/submit-order', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(orderData),
-    });
+    const result = await postOrder(orderData, idempotencyKeyFor(orderData));
 
-    const result = await response.json();
+    if (!result.success && result.quote) {
+      // Prices or stock changed since the page loaded; show the current cart
+      applyQuote(result.quote);
+      renderOrderSummary();
+      alert(`${result.message}\n\nPlease review your updated order and submit again.`);
+      const submitBtn = els.checkoutForm.querySelector('button[type="submit"]');
+      submitBtn.disabled = state.orderItems.length === 0;
+      submitBtn.textContent = 'Place Order';
+      return;
+    }
 
     if (result.success) {
       // Clear the cart
       localStorage.removeItem(CART_KEY);
+      localStorage.removeItem(CART_LOCATIONS_KEY);
+      state.pendingOrder = null;
       
       // Show confirmation
-      alert(`Order #${orderData.id} placed successfully!\n\nTotal: $${orderData.total.toFixed(2)}\n\nWe'll contact you shortly at ${orderData.customer.email}`);
+      alert(`Order #${result.orderId} placed successfully!\n\nTotal: $${orderData.total.toFixed(2)}\n\nWe'll contact you shortly at ${orderData.customer.email}`);
       
       // Redirect to home
       window.location.href = 'index.html';
@@ -201,5 +290,6 @@ els.checkoutForm.addEventListener('submit', handleSubmit);
 (async function init() {
   loadCartFromStorage();
   await loadInventory();
+  await refreshQuote();
   renderOrderSummary();
 })();
@@ -1,6 +1,7 @@
 const state = {
   orders: [],
   filter: 'all',
+  search: '', // non-empty: showing history search results (includes archived orders)
   lastOrderCount: 0,
 };
 
@@ -11,11 +12,20 @@ const els = {
   statusFilter: document.getElementById('statusFilter'),
   refreshBtn: document.getElementById('refreshBtn'),
   logoutBtn: document.getElementById('logoutBtn'),
+  historyForm: document.getElementById('historyForm'),
+  historySearch: document.getElementById('historySearch'),
 };
 
+function ordersUrl() {
+  if (!state.search) return '/api/orders';
+  const params = new URLSearchParams({ q: state.search });
+  if (state.filter !== 'all') params.set('status', state.filter);
+  return `/api/orders/search?${params}`;
+}
+
 async function loadOrders() {
   try {
-    const response = await fetch('/api/orders', { cache: 'no-store' });
+    const response = await fetch(ordersUrl(), { cache: 'no-store' });
     if (!response.ok) {
       if (response.status === 401) {
         window.location.href = 'login.html';
@@ -29,7 +39,7 @@ async function loadOrders() {
     state.orders.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
     
     // Check for new orders
-    checkNewOrders();
+    if (!state.search) checkNewOrders();
     
     render();
   } catch (error) {
@@ -117,7 +127,7 @@ function render() {
             <div class="order-id">Order #${order.id}</div>
             <div class="order-timestamp">${formatDate(order.timestamp)}</div>
           </div>
-          <span class="order-status ${getStatusClass(order.status)}">${order.status.toUpperCase()}</span>
+          <span class="order-status ${getStatusClass(order.status)}">${order.status.toUpperCase()}${order.archived ? ' · ARCHIVED' : ''}</span>
         </div>
         
         <div class="order-meta">
@@ -237,7 +247,13 @@ if (Notification.permission === 'default') {
 // Event listeners
 els.statusFilter.addEventListener('change', (e) => {
   state.filter = e.target.value;
-  render();
+  if (state.search) loadOrders(); else render();
+});
+
+els.historyForm.addEventListener('submit', (e) => {
+  e.preventDefault();
+  state.search = els.historySearch.value.trim();
+  loadOrders();
 });
 
 els.refreshBtn.addEventListener('click', loadOrders);